@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Benchmarks the collection-time overhead of pytest-random-order.
+
+Builds synthetic lists of test items shaped like a real test suite (packages, modules,
+classes and test functions), optionally with ``random_order(disabled=True)`` markers
+on some modules and with some tests marked as failed in the last run (``--failed-first``),
+and reports time and peak memory of each phase of ``pytest_collection_modifyitems``:
+
+    keys        bucket key function called for every item
+    disable     ``random_order`` marker lookup for every item
+    shuffle     ``_shuffle_items`` with the bucket key and marker lookup
+    integrity   the check that no test was lost or duplicated by shuffling
+    hook        the whole ``pytest_collection_modifyitems`` hook
+
+Run from the root of the repository:
+
+    $ python benchmarks/collection.py
+    $ python benchmarks/collection.py --sizes 1000 1000000 --bucket-types module class --json bench.json
+"""
+
+import argparse
+import atexit
+import collections
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from random_order import plugin  # noqa: E402
+from random_order.bucket_types import bucket_type_keys, compile_bucket_key  # noqa: E402
+from random_order.shuffler import _disable, _find_lost_items, _shuffle_items  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+TESTS_PER_CONTAINER = 10
+CLASSES_PER_MODULE = 2
+MODULES_PER_PACKAGE = 10
+
+# Every n-th module is marked with random_order(disabled=True), every n-th test failed last time.
+DISABLED_MODULE_EVERY = 5
+FAILED_TEST_EVERY = 100
+
+Marker = collections.namedtuple("Marker", field_names=("name", "args", "kwargs"))
+
+Result = collections.namedtuple(
+    "Result", field_names=("size", "bucket_type", "markers", "failed_first", "phase", "seconds", "peak_mib")
+)
+
+
+class FakeNode:
+    def __init__(self, name, nodeid, parent=None, markers=()):
+        self.name = name
+        self.nodeid = nodeid
+        self.parent = parent
+        self.own_markers = list(markers)
+
+    def get_closest_marker(self, name):
+        node = self
+        while node is not None:
+            for marker in node.own_markers:
+                if marker.name == name:
+                    return marker
+            node = node.parent
+        return None
+
+
+class FakeItem(FakeNode):
+    def __init__(self, name, parent):
+        super().__init__(name, "{0}::{1}".format(parent.nodeid, name), parent)
+
+
+_temp_cache_dir = []
+
+
+def get_temp_cache_dir():
+    if not _temp_cache_dir:
+        _temp_cache_dir.append(tempfile.mkdtemp(prefix="random-order-bench-"))
+        atexit.register(shutil.rmtree, _temp_cache_dir[0], True)
+    return _temp_cache_dir[0]
+
+
+class FakeCache:
+    def __init__(self, values):
+        self.values = values
+
+    def mkdir(self, name):
+        path = os.path.join(get_temp_cache_dir(), name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def get(self, key, default):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class FakeHooks:
+    def pytest_random_order_bucket_key_overrides(self, **kwargs):
+        return [plugin.pytest_random_order_bucket_key_overrides(**kwargs)]
+
+
+class FakeConfig:
+    def __init__(self, options, cache):
+        self.options = options
+        self.cache = cache
+        self.hook = FakeHooks()
+
+    def getoption(self, name, default=None):
+        return self.options.get(name, default)
+
+
+class FakeSession:
+    pass
+
+
+def make_items(size, markers=False):
+    """
+    Returns a list of `size` synthetic test items.
+    """
+    items = []
+    session = FakeNode("", "")
+    package_index = 0
+    while len(items) < size:
+        package_name = "pkg{0}".format(package_index)
+        package_path = "tests/{0}".format(package_name)
+        package = FakeNode(package_name, package_path, session)
+        for module_index in range(MODULES_PER_PACKAGE):
+            module_name = "test_m{0}".format(module_index)
+            path = "{0}/{1}.py".format(package_path, module_name)
+            module_markers = ()
+            if markers and module_index % DISABLED_MODULE_EVERY == 0:
+                module_markers = (Marker("random_order", (), {"disabled": True}),)
+            module_node = FakeNode(path, path, package, markers=module_markers)
+
+            containers = [module_node]
+            for class_index in range(CLASSES_PER_MODULE):
+                class_name = "TestC{0}".format(class_index)
+                containers.append(FakeNode(class_name, "{0}::{1}".format(path, class_name), module_node))
+
+            for container in containers:
+                for test_index in range(TESTS_PER_CONTAINER):
+                    items.append(FakeItem("test_{0}".format(test_index), container))
+                    if len(items) == size:
+                        return items
+        package_index += 1
+    return items
+
+
+def make_session_and_config(items, bucket_type, failed_first):
+    last_failed = {}
+    if failed_first:
+        last_failed = {item.nodeid: True for item in items[::FAILED_TEST_EVERY]}
+    config = FakeConfig(
+        options={
+            "random_order_enabled": True,
+            "random_order_bucket": bucket_type,
+            "random_order_seed": "1",
+            "random_order_mode": "default:shuffle",
+            "random_order_replay": False,
+            "random_order_replay_run": None,
+            "random_order_profile": False,
+            "random_order_profile_json": None,
+            "random_order_run_index": None,
+            "failedfirst": failed_first,
+        },
+        cache=FakeCache({"cache/lastfailed": last_failed}),
+    )
+    session = FakeSession()
+    session.random_order_bucket_type_key_handlers = []
+    reset_caches(session)
+    return session, config
+
+
+def reset_caches(session):
+    session.random_order_disabled_cache = {}
+
+
+def get_phases(items, bucket_type, failed_first):
+    """
+    Returns a list of (phase name, function) pairs, each function runs the phase once.
+    """
+    session, config = make_session_and_config(items, bucket_type, failed_first)
+    overrides = plugin.process_failed_first_last_failed(session, config, items)
+
+    def compile_key():
+        return compile_bucket_key(bucket_type_keys[bucket_type], overrides)
+
+    bucket_key = compile_key()
+    shuffled = list(items)
+    _shuffle_items(shuffled, bucket_key=bucket_key, disable=_disable, seed="1", session=session)
+
+    def keys():
+        bucket_key = compile_key()
+        for item in items:
+            bucket_key(item, session)
+
+    def disable():
+        reset_caches(session)
+        for item in items:
+            _disable(item, session)
+
+    def shuffle():
+        reset_caches(session)
+        _shuffle_items(list(items), bucket_key=compile_key(), disable=_disable, seed="1", session=session)
+
+    def integrity():
+        assert _find_lost_items(items, shuffled) == ([], [])
+
+    def hook():
+        hook_session, hook_config = make_session_and_config(items, bucket_type, failed_first)
+        plugin.pytest_collection_modifyitems(hook_session, hook_config, list(items))
+
+    return [("keys", keys), ("disable", disable), ("shuffle", shuffle), ("integrity", integrity), ("hook", hook)]
+
+
+def measure_time(f, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_peak_memory(f):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def run(sizes, bucket_types, repeat=3, memory=True):
+    """
+    Runs all phases for every combination of size, bucket type, markers and failed-first,
+    yields a `Result` for each phase.
+    """
+    for size in sizes:
+        for markers in (False, True):
+            items = make_items(size, markers=markers)
+            for bucket_type in bucket_types:
+                for failed_first in (False, True):
+                    for phase, f in get_phases(items, bucket_type, failed_first):
+                        seconds = measure_time(f, repeat)
+                        peak_mib = measure_peak_memory(f) if memory else None
+                        yield Result(size, bucket_type, markers, failed_first, phase, seconds, peak_mib)
+
+
+def format_result(result):
+    return (
+        "{r.size:>9} {r.bucket_type:<12} {markers:<8} {failed_first:<13} {r.phase:<10} {r.seconds:>10.4f} {peak}"
+    ).format(
+        r=result,
+        markers="yes" if result.markers else "no",
+        failed_first="yes" if result.failed_first else "no",
+        peak="{0:>10.2f}".format(result.peak_mib) if result.peak_mib is not None else "{0:>10}".format("-"),
+    )
+
+
+def main(argv=None):
+    bucket_types = [bt for bt in bucket_type_keys if bt != "none"]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of test items")
+    parser.add_argument("--bucket-types", nargs="+", default=bucket_types, choices=bucket_types)
+    parser.add_argument("--repeat", type=int, default=3, help="report the best time out of this many runs")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory (faster)")
+    parser.add_argument("--json", metavar="PATH", help="also write results to a JSON file")
+    args = parser.parse_args(argv)
+
+    print(
+        "{0:>9} {1:<12} {2:<8} {3:<13} {4:<10} {5:>10} {6:>10}".format(
+            "items", "bucket", "markers", "failed-first", "phase", "seconds", "peak MiB"
+        )
+    )
+    results = []
+    for result in run(args.sizes, args.bucket_types, repeat=args.repeat, memory=not args.no_memory):
+        print(format_result(result))
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r._asdict() for r in results], f, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Queries the history of orders and outcomes of tests (see `random_order.history`):
+
+    $ python -m random_order flaky
+    $ python -m random_order test tests/test_a.py::test_x
+    $ python -m random_order runs
+"""
+
+import argparse
+import os
+import sys
+from contextlib import closing
+
+from random_order import history
+from random_order.replay import PLANS_DIR_NAME, get_plan_path
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m random_order",
+        description="Query the history of orders and outcomes of tests recorded by pytest-random-order.",
+    )
+    parser.add_argument(
+        "--db",
+        default=history.DEFAULT_DATABASE_PATH,
+        help="Path of the history database (default: {0}).".format(history.DEFAULT_DATABASE_PATH),
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("flaky", help="List tests which both passed and failed, with run ids of the failed runs.")
+    test_parser = commands.add_parser("test", help="List the position and outcome of a test in each run.")
+    test_parser.add_argument("nodeid")
+    runs_parser = commands.add_parser("runs", help="List the last runs.")
+    runs_parser.add_argument("-n", type=int, default=20, help="Number of runs to list (default: 20).")
+    options = parser.parse_args(args)
+
+    if not os.path.isfile(options.db):
+        parser.error("no history database found at {0}".format(options.db))
+
+    with closing(history.connect(options.db)) as connection:
+        if options.command == "test":
+            for run_id, bucket_type, mode, digest, position, outcome, duration in history.get_test_history(
+                connection, options.nodeid
+            ):
+                print(
+                    "{0}: {1} at position {2} ({3:.3f}s), --random-order-bucket={4} --random-order-mode={5}, "
+                    "order {6}".format(run_id, outcome, position, duration, bucket_type, mode, digest)
+                )
+        elif options.command == "runs":
+            for run_id, bucket_type, mode, digest, tests, failed in history.get_runs(connection, options.n):
+                print(
+                    "{0}: {1} tests, {2} failed, --random-order-bucket={3} --random-order-mode={4}, order {5}".format(
+                        run_id, tests, failed, bucket_type, mode, digest
+                    )
+                )
+        else:
+            # Plans are saved next to the database, only those of the last runs are kept.
+            plans_dir = os.path.join(os.path.dirname(options.db), PLANS_DIR_NAME)
+            for nodeid, runs, failed, run_ids in history.get_flaky_tests(connection):
+                replayable = [run_id for run_id in run_ids if os.path.isfile(get_plan_path(plans_dir, run_id))]
+                line = "{0}: failed in {1} of {2} runs".format(nodeid, failed, runs)
+                if replayable:
+                    line += ", replay with --random-order-replay-run={0}".format(replayable[0])
+                print(line)
+                other_run_ids = [run_id for run_id in run_ids if run_id not in replayable[:1]]
+                if other_run_ids:
+                    print("  also failed in runs {0}".format(", ".join(other_run_ids)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
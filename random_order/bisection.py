@@ -0,0 +1,138 @@
+"""
+Search for the tests that make an order-dependent test fail, for ``--random-order-bisect``.
+
+The test is run after subsets of the tests that preceded it in the order of the current run
+(reproduced from ``--random-order-seed`` or ``--random-order-replay``), each subset in a separate
+pytest process, and the subsets are narrowed down with delta debugging (ddmin) to a minimal set
+of polluters: tests after which the test still fails, but which all have to run for it to fail.
+
+Candidate subsets of each round are independent, so they are run concurrently.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from random_order.child_runs import ChildRun
+from random_order.replay import write_plan
+
+
+class Bisection:
+    """
+    Finds the polluters of the test `target` among the tests that precede it in `items`.
+
+    `fails` is called with a list of node ids to run, in order, ending with `target`
+    and must return True if `target` failed. It is called from several threads at a time.
+    By default, it runs pytest in a subprocess with the arguments of the current run.
+    """
+
+    def __init__(self, config, items, target, workers=1, fails=None):
+        self.config = config
+        self.target = target
+        self.workers = max(1, workers or 1)
+        self.fails = fails or self.run_pytest
+        self.runs = 0
+        self._runs_lock = threading.Lock()
+
+        nodeids = [item.nodeid for item in items]
+        if target not in nodeids:
+            raise ValueError(target)
+        self.prefix = nodeids[: nodeids.index(target)]
+
+    def run(self):
+        """
+        Returns a `BisectionResult`.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            fails_alone, fails_after_prefix = executor.map(self._fails, [[], self.prefix])
+            if fails_alone:
+                return BisectionResult(self.target, "alone", [], self.runs)
+            if not fails_after_prefix:
+                return BisectionResult(self.target, "passed", [], self.runs)
+            polluters = find_polluters(self.prefix, self._fails, executor)
+        return BisectionResult(self.target, "polluted", polluters, self.runs)
+
+    def _fails(self, nodeids):
+        with self._runs_lock:
+            self.runs += 1
+        return self.fails(list(nodeids) + [self.target])
+
+    def run_pytest(self, nodeids):
+        """
+        Runs `nodeids` in this order in a new pytest process, returns True if the target failed.
+        """
+        with ChildRun(self.config, []) as child:
+            plan_path = child.path("plan.txt.gz")
+            write_plan(plan_path, nodeids, run_id="bisect", exclusive=True)
+            child.args.append("--random-order-replay-run={0}".format(plan_path))
+            child.run()
+            return self.target in child.get_failed()
+
+
+class BisectionResult:
+    def __init__(self, target, outcome, polluters, runs):
+        self.target = target
+        self.outcome = outcome
+        self.polluters = polluters
+        self.runs = runs
+
+    def format_lines(self):
+        runs = "{0} pytest runs".format(self.runs)
+        if self.outcome == "alone":
+            return [
+                "random-order bisect: {0} fails on its own, it does not depend on the tests run before it ({1})".format(
+                    self.target, runs
+                )
+            ]
+        if self.outcome == "passed":
+            return [
+                "random-order bisect: {0} passes after the tests run before it, "
+                "could not reproduce the failure ({1})".format(self.target, runs)
+            ]
+        lines = ["random-order bisect: {0} fails when run after these tests ({1}):".format(self.target, runs)]
+        lines.extend("  {0}".format(nodeid) for nodeid in self.polluters)
+        return lines
+
+
+def find_polluters(prefix, fails, executor):
+    """
+    Returns a 1-minimal subsequence of `prefix` for which `fails` returns True,
+    given that `fails(prefix)` is True and `fails([])` is False.
+
+    This is the ddmin algorithm: `prefix` is split into `n` parts, if any part fails on its own
+    the search continues in it, otherwise if removing any part still fails the search continues
+    without it, otherwise the parts are made smaller. All candidates of a round are
+    passed to `fails` through `executor` at once.
+    """
+    candidates = list(prefix)
+    n = 2
+    while len(candidates) >= 2:
+        subsets = _split(candidates, n)
+        complements = []
+        if n > 2:
+            # With two subsets, the complement of each one is the other one.
+            complements = [[x for j, s in enumerate(subsets) if j != i for x in s] for i in range(len(subsets))]
+
+        results = list(executor.map(fails, subsets + complements))
+
+        if any(results[: len(subsets)]):
+            candidates = subsets[results.index(True)]
+            n = 2
+        elif any(results[len(subsets) :]):
+            candidates = complements[results.index(True) - len(subsets)]
+            n = max(n - 1, 2)
+        elif n < len(candidates):
+            n = min(len(candidates), n * 2)
+        else:
+            break
+    return candidates
+
+
+def _split(sequence, n):
+    size, remainder = divmod(len(sequence), n)
+    parts = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < remainder else 0)
+        parts.append(sequence[start:end])
+        start = end
+    return parts
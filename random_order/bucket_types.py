@@ -1,67 +1,236 @@
+import argparse
 import functools
-import os.path
+import posixpath
+import re
+import sys
 from collections import OrderedDict
 
+from random_order.fixtures import get_fixture_bucket_path, get_fixture_components
+
 bucket_type_keys = OrderedDict()
 
+nodeid_key_functions = OrderedDict()
+
+# Tokens of node ids which tell parameters apart from separators of names of nodes.
+_NODEID_TOKENS = re.compile(r"::|\[|\]")
+
+# Separates levels of a hierarchical bucket type, like "package/module/class".
+HIERARCHY_SEPARATOR = "/"
 
-def bucket_type_key(bucket_type):
+
+def bucket_type_key(bucket_type, per_parent=True):
     """
     Registers a function that calculates test item key for the specified bucket type.
+
+    If `per_parent` is True, all items with the same parent are known to have the same key
+    so `compile_bucket_key` calls the function once per parent node and reuses the result
+    for its other children.
     """
 
     def decorator(f):
         @functools.wraps(f)
         def wrapped(item, session):
-            key = f(item)
+            return f(item)
+
+        wrapped.key_function = f
+        wrapped.per_parent = per_parent
+        bucket_type_keys[bucket_type] = wrapped
+        return wrapped
+
+    return decorator
+
+
+def compile_bucket_key(bucket_key, overrides=None, handlers=()):
+    """
+    Returns a function with the signature of a registered bucket key function (`item`, `session`)
+    which calculates the key with `bucket_key`, once per parent if possible,
+    unless the item's node id is in `overrides` (a mapping of node ids to keys),
+    and passes the result through legacy `handlers` (functions of `item` and `key`, if any).
+
+    All of it is resolved once here, so the only per-item cost is a dictionary lookup
+    for each of node id (if there are overrides) and parent (if the key is calculated per parent).
+    """
+    f = bucket_key.key_function
+    handlers = list(handlers)
+
+    if bucket_key.per_parent:
+        parent_keys = {}
+
+        def base_key(item):
+            parent = getattr(item, "parent", None)
+            if parent is None:
+                return f(item)
+            try:
+                return parent_keys[parent]
+            except KeyError:
+                key = parent_keys[parent] = f(item)
+                return key
+
+    else:
+        base_key = f
 
-            if session is not None:
-                for handler in session.random_order_bucket_type_key_handlers:
-                    key = handler(item, key)
+    if overrides:
+        get_override = overrides.get
+        missing = object()
 
+        def overridden_key(item):
+            key = get_override(item.nodeid, missing)
+            if key is missing:
+                return base_key(item)
             return key
 
-        bucket_type_keys[bucket_type] = wrapped
-        return wrapped
+    else:
+        overridden_key = base_key
+
+    if not handlers:
+        return lambda item, session: overridden_key(item)
+
+    def compiled_key(item, session):
+        key = overridden_key(item)
+        for handler in handlers:
+            key = handler(item, key)
+        return key
+
+    return compiled_key
+
+
+def nodeid_bucket_type_key(bucket_type):
+    """
+    Registers a function that calculates the key of the specified bucket type from the node id of
+    the parent of a test item (see `split_nodeid`) alone, so that keys are the same for all kinds of
+    items and can be calculated from a list of node ids (see `get_nodeid_key`).
+
+    The function is also registered with `bucket_type_key` as a function of the item, which is called
+    once per parent node with the node id of the parent node, and the keys it returns are interned.
+    """
+
+    def decorator(f):
+        nodeid_key_functions[bucket_type] = f
+
+        def get_item_key(item):
+            return sys.intern(f(get_parent_nodeid(item)))
+
+        get_item_key.__name__ = f.__name__
+        get_item_key.__doc__ = f.__doc__
+        bucket_type_key(bucket_type)(get_item_key)
+        return f
 
     return decorator
 
 
+def get_parent_nodeid(item):
+    """
+    Returns the node id of the parent node of `item`, or its node id split with `split_nodeid`
+    if it has no parent node with a node id (it is not inside a module).
+    """
+    parent = getattr(item, "parent", None)
+    parent_nodeid = getattr(parent, "nodeid", "")
+    return parent_nodeid if parent_nodeid else split_nodeid(item.nodeid)[0]
+
+
+def split_nodeid(nodeid):
+    """
+    Returns a tuple of the node id of the parent (a module or a class) of the test with node id `nodeid`
+    and the name of the test, without parameters (a trailing "[...]", which may contain "::").
+    Names of other nodes may contain balanced brackets, like "spec.yaml::suite[x]::case".
+    A node id of a test which is not inside a module is its own parent.
+
+    Parameters with unbalanced brackets, like "a.py::t[]::[]", cannot be told apart from names of nodes,
+    so keys of items are calculated from the node ids of their parents (see `get_parent_nodeid`) instead.
+    """
+    if "[" not in nodeid:
+        parent, separator, name = nodeid.rpartition("::")
+        return (parent, name) if separator else (nodeid, "")
+
+    # The last "::" outside brackets separates the parent from the name.
+    start = end = -1
+    depth = 0
+    for match in _NODEID_TOKENS.finditer(nodeid):
+        token = match.group()
+        if token == "[":
+            if depth == 0 and end == -1:
+                end = match.start()
+            depth += 1
+        elif token == "]":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            start = match.start()
+            end = -1
+    if start == -1:
+        return nodeid, ""
+    return nodeid[:start], nodeid[start + 2 : end if end != -1 and nodeid.endswith("]") else len(nodeid)]
+
+
+def get_nodeid_key(nodeid, bucket_type, cache=None):
+    """
+    Returns the key of the bucket of `bucket_type` (a bucket type registered with `nodeid_bucket_type_key`,
+    or several of them separated by "/") of the test with node id `nodeid`,
+    the same as the key of the test item.
+
+    Keys are calculated once per parent node id if `cache` (a dictionary) is passed.
+    """
+    parent = split_nodeid(nodeid)[0]
+    if cache is not None and parent in cache:
+        return cache[parent]
+
+    levels = bucket_type.split(HIERARCHY_SEPARATOR)
+    if len(levels) == 1:
+        key = sys.intern(nodeid_key_functions[bucket_type](parent))
+    else:
+        key = HierarchicalKey(sys.intern(nodeid_key_functions[level](parent)) for level in levels)
+
+    if cache is not None:
+        cache[parent] = key
+    return key
+
+
 @bucket_type_key("global")
 def get_global_key(item):
     return None
 
 
-@bucket_type_key("package")
-def get_package_key(item):
-    if not hasattr(item, "module"):
-        return os.path.split(item.location[0])[0]
-    return item.module.__package__
+@nodeid_bucket_type_key("package")
+def get_package_key(parent_nodeid):
+    return posixpath.dirname(parent_nodeid.partition("::")[0])
 
 
-@bucket_type_key("module")
-def get_module_key(item):
-    return item.location[0]
+@nodeid_bucket_type_key("module")
+def get_module_key(parent_nodeid):
+    return parent_nodeid.partition("::")[0]
 
 
-@bucket_type_key("class")
-def get_class_key(item):
-    if not hasattr(item, "cls"):
-        return item.location[0]
-    if item.cls:
-        return item.module.__name__, item.cls.__name__
-    else:
-        return item.module.__name__
+@nodeid_bucket_type_key("class")
+def get_class_key(parent_nodeid):
+    return parent_nodeid
 
 
-@bucket_type_key("parent")
-def get_parent_key(item):
-    return item.parent
+@nodeid_bucket_type_key("parent")
+def get_parent_key(parent_nodeid):
+    return parent_nodeid
 
 
-@bucket_type_key("grandparent")
-def get_grandparent_key(item):
-    return item.parent.parent
+@nodeid_bucket_type_key("grandparent")
+def get_grandparent_key(parent_nodeid):
+    if "::" in parent_nodeid:
+        return parent_nodeid.rpartition("::")[0]
+    return posixpath.dirname(parent_nodeid)
+
+
+@bucket_type_key("fixture", per_parent=False)
+def get_fixture_key(item):
+    """
+    Returns the path of `item` within the group of tests of the session which share higher-scoped
+    fixture instances with it (see `random_order.fixtures.get_fixture_bucket_path`) as a `HierarchicalKey`,
+    so that groups, and packages, modules and classes within them, are shuffled level by level.
+    Groups are calculated for all tests at once.
+    """
+    session = getattr(item, "session", None)
+    components = getattr(session, "random_order_fixture_components", None)
+    if components is None and session is not None:
+        components = session.random_order_fixture_components = get_fixture_components(session.items)
+    if components is None or item not in components:
+        components = get_fixture_components([item])
+    return HierarchicalKey(get_fixture_bucket_path(item, components[item]))
 
 
 @bucket_type_key("none")
@@ -70,3 +239,59 @@ def get_none_key(item):
 
 
 bucket_types = bucket_type_keys.keys()
+
+
+class HierarchicalKey(tuple):
+    """
+    Key of a bucket of a hierarchical bucket type: a tuple of keys of the bucket at each level,
+    from the outermost to the innermost.
+    """
+
+    __slots__ = ()
+
+
+def get_bucket_key(bucket_type):
+    """
+    Returns the bucket key function of `bucket_type`, which is either a registered bucket type or
+    registered bucket types separated by "/" (a hierarchical bucket type).
+
+    The key of a hierarchical bucket type is a `HierarchicalKey` of the keys of all its levels.
+    The function has the `key_function` and `per_parent` attributes of a registered one,
+    so it can be passed to `compile_bucket_key`.
+    """
+    levels = bucket_type.split(HIERARCHY_SEPARATOR)
+    if len(levels) == 1:
+        return bucket_type_keys[bucket_type]
+
+    key_functions = [bucket_type_keys[level].key_function for level in levels]
+
+    def get_hierarchical_key(item):
+        return HierarchicalKey(f(item) for f in key_functions)
+
+    def wrapped(item, session):
+        return get_hierarchical_key(item)
+
+    wrapped.key_function = get_hierarchical_key
+    wrapped.per_parent = all(bucket_type_keys[level].per_parent for level in levels)
+    return wrapped
+
+
+def bucket_type_option(value):
+    """
+    Validates the value of ``--random-order-bucket``: a bucket type or bucket types
+    (other than ``global`` and ``none``) separated by "/".
+    """
+    bucket_type = value[len("default:") :] if value.startswith("default:") else value
+    levels = bucket_type.split(HIERARCHY_SEPARATOR)
+    if len(levels) == 1:
+        valid = bucket_type in bucket_type_keys
+    else:
+        valid = all(level in bucket_type_keys and level not in ("global", "none") for level in levels)
+    if not valid:
+        raise argparse.ArgumentTypeError(
+            "invalid choice: {0!r} (choose from {1}, or several of them separated by {2!r}, "
+            "for example 'package/module/class')".format(
+                bucket_type, ", ".join(map(repr, bucket_type_keys)), HIERARCHY_SEPARATOR
+            )
+        )
+    return value
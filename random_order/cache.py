@@ -5,35 +5,164 @@ This module is called "cache" because it builds on the "cache" plugin:
 
 """
 
+import os
+
 FAILED_FIRST_LAST_FAILED_BUCKET_KEY = "<failed_first_last_failed>"
 
+NEW_FIRST_BUCKET_KEY = "<new_first>"
+
+# Buckets which go before all other buckets, in this order.
+PINNED_BUCKET_KEYS = (FAILED_FIRST_LAST_FAILED_BUCKET_KEY, NEW_FIRST_BUCKET_KEY)
+
+DURATIONS_CACHE_KEY = "random_order/durations"
+
+FAILURES_CACHE_KEY = "random_order/failures"
+
+RUN_INDEX_CACHE_KEY = "random_order/run_index"
+
+CACHE_DIR_NAME = "random_order"
+
 
 def process_failed_first_last_failed(session, config, items):
-    if not hasattr(config, "cache"):
-        return
+    """
+    Returns bucket key overrides (see `random_order.hooks`) that put
+    all tests that failed in the last run in one bucket which runs first.
+
+    A test failed in the last run if its node id, or the node id of any of its parents
+    (a module or class that failed to be collected), is in ``cache/lastfailed``.
+    """
+    if not hasattr(config, "cache") or config.cache is None:
+        return {}
 
     if not config.getoption("failedfirst"):
-        return
-
-    last_failed_raw = config.cache.get("cache/lastfailed", None)
-    if not last_failed_raw:
-        return
-
-    # Get the names of last failed tests
-    last_failed = []
-    for key in last_failed_raw.keys():
-        parts = key.split("::")
-        if len(parts) == 3:
-            last_failed.append(tuple(parts))
-        elif len(parts) == 2:
-            last_failed.append((parts[0], None, parts[1]))
-        else:
-            raise NotImplementedError()
-
-    def assign_last_failed_to_same_bucket(item, key):
-        if item.nodeid in last_failed_raw:
-            return FAILED_FIRST_LAST_FAILED_BUCKET_KEY
-        else:
-            return key
-
-    session.random_order_bucket_type_key_handlers.append(assign_last_failed_to_same_bucket)
+        return {}
+
+    last_failed = config.cache.get("cache/lastfailed", None)
+    if not last_failed:
+        return {}
+
+    index = NodeIdIndex(last_failed)
+    return dict.fromkeys((item.nodeid for item in items if item in index), FAILED_FIRST_LAST_FAILED_BUCKET_KEY)
+
+
+def process_new_first(session, config, items):
+    """
+    Returns bucket key overrides (see `random_order.hooks`) that put all tests
+    which were not collected in previous runs in one bucket which runs after the last failed bucket
+    and before all other buckets, if ``--new-first`` is passed.
+    """
+    if not hasattr(config, "cache") or config.cache is None:
+        return {}
+
+    if not config.getoption("newfirst", False):
+        return {}
+
+    known = config.cache.get("cache/nodeids", None)
+    if not known:
+        # Nothing is known before the first run, so nothing is new either.
+        return {}
+
+    known = set(known)
+    return dict.fromkeys((item.nodeid for item in items if item.nodeid not in known), NEW_FIRST_BUCKET_KEY)
+
+
+class NodeIdIndex:
+    """
+    A set of node ids which contains an item (``item in index``) if the item's node id,
+    or the node id of any of its parents, is in the set.
+
+    Parents are looked up once each, so checking all items of a session costs
+    a set lookup per item and per parent node.
+    """
+
+    def __init__(self, nodeids):
+        self.nodeids = frozenset(nodeids)
+        self._parents = {}
+
+    def __contains__(self, node):
+        if node.nodeid in self.nodeids:
+            return True
+        parent = getattr(node, "parent", None)
+        if parent is None:
+            return False
+        try:
+            return self._parents[parent]
+        except KeyError:
+            contains = self._parents[parent] = parent in self
+            return contains
+
+
+def load_durations(config):
+    """
+    Returns a dictionary of test durations (in seconds) recorded by `HistoryRecorder`
+    in previous runs, keyed by test node id.
+    """
+    if not hasattr(config, "cache") or config.cache is None:
+        return {}
+    return config.cache.get(DURATIONS_CACHE_KEY, {})
+
+
+def load_failures(config):
+    """
+    Returns a dictionary of ``[runs, failures]`` counts of tests recorded by `HistoryRecorder`
+    in previous runs, keyed by test node id.
+    """
+    if not hasattr(config, "cache") or config.cache is None:
+        return {}
+    return config.cache.get(FAILURES_CACHE_KEY, {})
+
+
+class HistoryRecorder:
+    """
+    Records how long each test took (setup, call and teardown together) and whether it failed,
+    and merges that into the cache at the end of the session.
+
+    Runs and failures are counted per test. Once a test has `MAX_RUNS` runs, both counts
+    are halved, so that failures of the recent runs weigh more than old ones.
+    """
+
+    MAX_RUNS = 100
+
+    def __init__(self, config):
+        self.config = config
+        self.durations = {}
+        self.failed = set()
+
+    def pytest_runtest_logreport(self, report):
+        self.durations[report.nodeid] = self.durations.get(report.nodeid, 0.0) + report.duration
+        if report.failed:
+            self.failed.add(report.nodeid)
+
+    def pytest_sessionfinish(self, session):
+        if not self.durations:
+            return
+        durations = load_durations(self.config)
+        durations.update((nodeid, round(duration, 4)) for nodeid, duration in self.durations.items())
+        self.config.cache.set(DURATIONS_CACHE_KEY, durations)
+
+        failures = load_failures(self.config)
+        for nodeid in self.durations:
+            runs, failed = failures.get(nodeid, (0, 0))
+            runs, failed = runs + 1, failed + (nodeid in self.failed)
+            if runs >= self.MAX_RUNS:
+                runs, failed = runs // 2, failed // 2
+            failures[nodeid] = [runs, failed]
+        self.config.cache.set(FAILURES_CACHE_KEY, failures)
+
+
+def get_cache_dir(config, *path):
+    """
+    Returns the path of a directory for the plugin's files in pytest cache (creating it
+    and the optional subdirectories in `path` if needed), or None if the cache plugin is disabled.
+    """
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return None
+    if hasattr(cache, "mkdir"):
+        cache_dir = str(cache.mkdir(CACHE_DIR_NAME))
+    else:
+        cache_dir = str(cache.makedir(CACHE_DIR_NAME))
+    cache_dir = os.path.join(cache_dir, *path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
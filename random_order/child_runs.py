@@ -0,0 +1,103 @@
+"""
+Runs of pytest in separate processes, used by ``--random-order-bisect`` and ``--random-order-sweep``.
+
+A child run gets the command line arguments of the current run (without the options which
+start child runs) and its own temporary cache and base temporary directories, so that child runs
+can run concurrently and do not touch the cache of the current run. Their results are read
+from their cache directories.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from random_order.cache import CACHE_DIR_NAME
+
+# Options which start child runs and are not passed on to them.
+PARENT_OPTIONS = ("--random-order-bisect", "--random-order-sweep", "--random-order-workers")
+
+# Layout of pytest cache directory: values set with cache.set() and directories made with cache.mkdir().
+CACHE_VALUES_DIR_NAME = "v"
+CACHE_DIRS_DIR_NAME = "d"
+
+
+class ChildRun:
+    """
+    A context manager for a pytest process with the arguments of the current run followed by `args`.
+    The temporary directory of the run is removed on exit.
+    """
+
+    def __init__(self, config, args):
+        self.config = config
+        self.args = list(args)
+        self.tmp_dir = None
+        self.returncode = None
+
+    def __enter__(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="random-order-")
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self.tmp_dir, "cache")
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def run(self):
+        args = [sys.executable, "-m", "pytest"] + get_child_args(self.config) + self.args
+        args += [
+            "--basetemp={0}".format(self.path("basetemp")),
+            "-o",
+            "cache_dir={0}".format(self.cache_dir),
+            "-q",
+        ]
+        if self.config.pluginmanager.hasplugin("xdist"):
+            args += ["-n", "0"]
+        self.returncode = subprocess.call(
+            args,
+            cwd=str(self.config.invocation_params.dir),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return self.returncode
+
+    def get_failed(self):
+        """
+        Returns the node ids of tests that failed in the run, in no particular order.
+        """
+        try:
+            with open(os.path.join(self.cache_dir, CACHE_VALUES_DIR_NAME, "cache", "lastfailed")) as f:
+                return list(json.load(f))
+        except IOError:
+            return []
+
+    def get_plugin_path(self, *parts):
+        """
+        Returns the path of a file in the plugin's directory of the run's cache (see `cache.get_cache_dir`).
+        """
+        return os.path.join(self.cache_dir, CACHE_DIRS_DIR_NAME, CACHE_DIR_NAME, *parts)
+
+
+def get_child_args(config):
+    """
+    Returns the command line arguments of the current pytest run without `PARENT_OPTIONS`.
+    """
+    args = []
+    skip_value = False
+    for arg in config.invocation_params.args:
+        if skip_value:
+            skip_value = False
+            continue
+        name = arg.split("=", 1)[0]
+        if name in PARENT_OPTIONS:
+            skip_value = "=" not in arg
+            continue
+        args.append(arg)
+    return args
@@ -15,11 +15,84 @@ class Config:
 
     @property
     def is_enabled(self):
-        return self._config.getoption("random_order_enabled") or any(
-            not self._config.getoption(name).startswith("default:")
-            for name in ("random_order_bucket", "random_order_seed")
+        return (
+            self._config.getoption("random_order_enabled")
+            or self.replay is not None
+            or self.sample is not None
+            or self.shard is not None
+            or any(
+                not self._config.getoption(name).startswith("default:")
+                for name in ("random_order_bucket", "random_order_seed", "random_order_mode")
+            )
         )
 
+    @property
+    def replay(self):
+        """
+        Run id of the plan to replay, "last" for the last one, or None if not replaying.
+        """
+        run_id = self._config.getoption("random_order_replay_run")
+        if run_id is not None:
+            return run_id
+        if self._config.getoption("random_order_replay"):
+            return "last"
+        return None
+
+    @property
+    def profile(self):
+        """
+        Path of the JSON file to write the profile to, "" to only report it, or None if not profiling.
+        """
+        path = self._config.getoption("random_order_profile_json")
+        if path is not None:
+            return path
+        if self._config.getoption("random_order_profile"):
+            return ""
+        return None
+
+    @property
+    def sample(self):
+        """
+        Size of the sample of tests to run (a number or a percentage like "10%"), or None to run all tests.
+        """
+        return self._config.getoption("random_order_sample")
+
+    @property
+    def shard(self):
+        """
+        The shard of tests to run, "i/n", or None to run all tests.
+        """
+        return self._config.getoption("random_order_shard")
+
+    @property
+    def durations(self):
+        """
+        Path of the JSON file of test durations to split shards by, or None to split them by the number of tests.
+        """
+        return self._config.getoption("random_order_durations")
+
+    @property
+    def mode(self):
+        return self._remove_default_prefix(self._config.getoption("random_order_mode"))
+
+    @property
+    def run_index(self):
+        """
+        Index of the run in the sequence of orders of the covering mode, or None for other modes.
+        """
+        if self.mode != "covering":
+            return None
+        return self._config.getoption("random_order_run_index") or 0
+
+    @property
+    def run_id(self):
+        """
+        Identifies the order of this run among saved plans: the seed, and the run index in covering mode.
+        """
+        if self.run_index is None:
+            return self.seed
+        return "{0}-{1}".format(self.seed, self.run_index)
+
     @property
     def seed(self):
         return self._remove_default_prefix(self._config.getoption("random_order_seed"))
@@ -0,0 +1,145 @@
+"""
+Support for the ``fixture`` bucket type which keeps tests that share expensive,
+higher-scoped fixtures (``class``, ``module``, ``package`` scopes, and parametrized ``session`` ones)
+next to each other, so pytest can reuse the fixture instead of setting it up again.
+"""
+
+from collections import defaultdict
+
+import pytest
+
+# Node classes that own fixture instances of each scope.
+SCOPE_NODE_TYPES = {
+    "class": ("Class", "Module"),
+    "module": ("Module",),
+    "package": ("Package",),
+}
+
+
+def get_higher_scope_fixtures(item):
+    """
+    Returns a sorted tuple of ``(fixture name, scope node id, param index)`` triples,
+    one for each fixture instance used by ``item`` which outlives a single test.
+
+    Two items with the same triple share the same fixture instance as long as
+    they run one after another.
+    """
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    if fixtureinfo is None:
+        return ()
+
+    callspec = getattr(item, "callspec", None)
+    indices = getattr(callspec, "indices", {}) if callspec is not None else {}
+
+    fixtures = []
+    for name, fixturedefs in fixtureinfo.name2fixturedefs.items():
+        if not fixturedefs:
+            continue
+        scope = fixturedefs[-1].scope
+        if scope == "function":
+            continue
+        param_index = indices.get(name)
+        if scope == "session" and param_index is None:
+            # Set up once per session no matter the order.
+            continue
+        fixtures.append((name, _get_scope_node_id(item, scope), param_index))
+
+    return tuple(sorted(fixtures, key=repr))
+
+
+def get_fixture_components(items):
+    """
+    Groups ``items`` which share higher-scoped fixture instances, directly or through other items
+    (a test using ``db`` and a test using ``db`` and ``cache`` are in the same group, and so is
+    a test using only ``cache``), and returns a dictionary of group keys keyed by item.
+
+    The key of a group is the sorted tuple of all fixture instances its items use,
+    items which use none of them all get an empty tuple.
+    """
+    parents = {}
+
+    def find(fixture):
+        root = parents.setdefault(fixture, fixture)
+        while root != parents[root]:
+            root = parents[root]
+        while fixture != root:
+            parents[fixture], fixture = root, parents[fixture]
+        return root
+
+    item_fixtures = []
+    for item in items:
+        fixtures = get_higher_scope_fixtures(item)
+        item_fixtures.append((item, fixtures))
+        if fixtures:
+            root = find(fixtures[0])
+            for fixture in fixtures[1:]:
+                other = find(fixture)
+                if other != root:
+                    parents[other] = root
+
+    members = defaultdict(list)
+    for fixture in parents:
+        members[find(fixture)].append(fixture)
+    keys = {root: tuple(sorted(fixtures, key=repr)) for root, fixtures in members.items()}
+
+    return {item: keys[find(fixtures[0])] if fixtures else () for item, fixtures in item_fixtures}
+
+
+def get_fixture_bucket_path(item, component):
+    """
+    Returns the path of ``item`` within the group of tests ``component`` (a key returned by
+    `get_fixture_components`): the group, the parametrized ``session`` scoped fixture instances
+    the item uses and the node ids of its package, module and class ("" where there is none).
+
+    Tests of a group are ordered by their paths level by level, so that tests which share
+    a fixture instance of any scope run one after another. Tests that use no higher-scoped
+    fixtures all get the same path.
+    """
+    if not component:
+        return (), (), "", "", ""
+    session_fixtures = tuple(fixture for fixture in get_higher_scope_fixtures(item) if not fixture[1])
+    return (
+        component,
+        session_fixtures,
+        _get_parent_node_id(item, "Package"),
+        _get_parent_node_id(item, "Module"),
+        _get_parent_node_id(item, "Class"),
+    )
+
+
+def _get_scope_node_id(item, scope):
+    for node_type_name in SCOPE_NODE_TYPES.get(scope, ()):
+        nodeid = _get_parent_node_id(item, node_type_name)
+        if nodeid:
+            return nodeid
+    return ""
+
+
+def _get_parent_node_id(item, node_type_name):
+    node_type = getattr(pytest, node_type_name, None)
+    if node_type is None:
+        return ""
+    node = item.getparent(node_type)
+    return node.nodeid if node is not None else ""
+
+
+def count_fixture_setups(items):
+    """
+    Counts how many times higher-scoped fixtures would be set up if ``items`` ran in this order.
+
+    A fixture instance stays alive while consecutive items remain within the node
+    that owns it (the class, module or package), so it has to be set up again each time
+    the run re-enters that node after having left it.
+    """
+    setups = 0
+    alive = set()
+    for item in items:
+        fixtures = get_higher_scope_fixtures(item)
+        chain = set(node.nodeid for node in item.listchain()) if hasattr(item, "listchain") else set()
+        chain.add("")
+        alive = set(f for f in alive if f[1] in chain)
+        for fixture in fixtures:
+            if fixture not in alive:
+                setups += 1
+                alive.add(fixture)
+    return setups
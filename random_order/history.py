@@ -0,0 +1,286 @@
+"""
+History of the orders tests ran in and their outcomes, kept in an SQLite database in the plugin's
+directory in pytest cache, so that tests which fail only in some orders can be found with a query:
+
+    $ python -m random_order flaky
+    $ python -m random_order test tests/test_a.py::test_x
+    $ python -m random_order runs
+
+Runs are recorded with ``--random-order-history`` (and with ``--random-order-mode=guided``, which reads them).
+Each run adds a row to the ``runs`` table (seed, run id, bucket type, mode and a digest of the order of tests)
+and a row per test to the ``results`` table (position in the order, outcome and duration) which refers to
+the node id of the test in the ``tests`` table. Only the last `MAX_RUNS` runs, and only as many of the last
+runs as have no more than `MAX_RESULTS` results between them, are kept.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from random_order.cache import CACHE_DIR_NAME, get_cache_dir
+from random_order.config import Config
+from random_order.replay import load_plan
+
+DATABASE_FILE_NAME = "history.sqlite3"
+
+# Path of the database relative to the root directory when pytest cache is in its default location.
+DEFAULT_DATABASE_PATH = os.path.join(".pytest_cache", "d", CACHE_DIR_NAME, DATABASE_FILE_NAME)
+
+MAX_RUNS = 1000
+
+MAX_RESULTS = 1000000
+
+# Databases of other versions of the schema are recreated.
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    run_id TEXT,
+    seed TEXT,
+    bucket_type TEXT,
+    mode TEXT,
+    order_digest TEXT,
+    tests INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_order_digest ON runs (order_digest);
+
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    nodeid TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL,
+    test INTEGER NOT NULL,
+    position INTEGER,
+    outcome TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (run, test)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path):
+    """
+    Returns a connection to the history database at `path`, creating its tables if needed.
+    """
+    connection = sqlite3.connect(path, timeout=30)
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        connection.executescript(
+            "DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS tests; DROP TABLE IF EXISTS runs;"
+            + SCHEMA
+            + "PRAGMA user_version = {0};".format(SCHEMA_VERSION)
+        )
+    return connection
+
+
+def get_order_digest(nodeids):
+    """
+    Returns a short digest which is the same for runs with the same tests in the same order.
+    """
+    return hashlib.sha1("\n".join(nodeids).encode("utf-8")).hexdigest()[:16]
+
+
+def add_run(connection, results, order, **info):
+    """
+    Adds a run with `info` (columns of the ``runs`` table) to the database, along with its `results`,
+    a dictionary of tuples of outcome and duration keyed by node id. `order` is the list of node ids
+    in the order they ran in. Removes old runs (see `remove_old_runs`). Returns the id of the added run.
+    """
+    positions = {nodeid: i for i, nodeid in enumerate(order)}
+    with connection:
+        test_ids = dict(connection.execute("SELECT nodeid, id FROM tests"))
+        new_nodeids = [(nodeid,) for nodeid in results if nodeid not in test_ids]
+        if new_nodeids:
+            connection.executemany("INSERT INTO tests (nodeid) VALUES (?)", new_nodeids)
+            test_ids = dict(connection.execute("SELECT nodeid, id FROM tests"))
+        cursor = connection.execute(
+            "INSERT INTO runs (finished, run_id, seed, bucket_type, mode, order_digest, tests, failed) "
+            "VALUES (:finished, :run_id, :seed, :bucket_type, :mode, :order_digest, :tests, :failed)",
+            dict(
+                dict.fromkeys(("run_id", "seed", "bucket_type", "mode")),
+                finished=time.time(),
+                order_digest=get_order_digest(order),
+                tests=len(results),
+                failed=sum(outcome == "failed" for outcome, _ in results.values()),
+                **info,
+            ),
+        )
+        run = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO results (run, test, position, outcome, duration) VALUES (?, ?, ?, ?, ?)",
+            (
+                (run, test_ids[nodeid], positions.get(nodeid), outcome, round(duration, 4))
+                for nodeid, (outcome, duration) in results.items()
+            ),
+        )
+        remove_old_runs(connection)
+    return run
+
+
+def remove_old_runs(connection):
+    """
+    Removes runs beyond the last `MAX_RUNS`, and the oldest runs for as long as there are more than
+    `MAX_RESULTS` results (but never the last run), with their results. Node ids no longer referred to
+    are removed once there are twice as many of them as tests in the last run.
+    """
+    oldest = None
+    results = 0
+    for i, (run, tests) in enumerate(connection.execute("SELECT id, tests FROM runs ORDER BY id DESC")):
+        results += tests
+        if i and (i >= MAX_RUNS or results > MAX_RESULTS):
+            oldest = run
+            break
+    if oldest is None:
+        return
+    connection.execute("DELETE FROM results WHERE run <= ?", (oldest,))
+    connection.execute("DELETE FROM runs WHERE id <= ?", (oldest,))
+
+    last_run_tests = connection.execute("SELECT tests FROM runs ORDER BY id DESC LIMIT 1").fetchone()[0]
+    if connection.execute("SELECT COUNT(*) FROM tests").fetchone()[0] > 2 * last_run_tests:
+        connection.execute("DELETE FROM tests WHERE id NOT IN (SELECT test FROM results)")
+
+
+def get_flaky_tests(connection):
+    """
+    Returns a list of tuples of node id, number of runs, number of failed runs and run ids of the failed runs
+    (the latest first) of tests which both passed and failed, the most often failed first.
+    """
+    rows = connection.execute(
+        "SELECT tests.nodeid, COUNT(*), SUM(outcome = 'failed') FROM results JOIN tests ON tests.id = results.test "
+        "GROUP BY results.test HAVING SUM(outcome = 'failed') > 0 AND SUM(outcome = 'passed') > 0 "
+        "ORDER BY SUM(outcome = 'failed') DESC, tests.nodeid"
+    ).fetchall()
+    failed_run_ids = {}
+    for nodeid, run_id in connection.execute(
+        "SELECT tests.nodeid, runs.run_id FROM results JOIN runs ON runs.id = results.run "
+        "JOIN tests ON tests.id = results.test WHERE results.outcome = 'failed' ORDER BY runs.id DESC"
+    ):
+        failed_run_ids.setdefault(nodeid, []).append(run_id)
+    return [(nodeid, runs, failed, failed_run_ids[nodeid]) for nodeid, runs, failed in rows]
+
+
+def get_test_history(connection, nodeid):
+    """
+    Returns a list of tuples of run id, bucket type, mode, order digest, position, outcome and duration
+    of test `nodeid` in each run, the latest first.
+    """
+    return connection.execute(
+        "SELECT runs.run_id, runs.bucket_type, runs.mode, runs.order_digest, "
+        "results.position, results.outcome, results.duration "
+        "FROM results JOIN runs ON runs.id = results.run "
+        "WHERE results.test = (SELECT id FROM tests WHERE nodeid = ?) ORDER BY runs.id DESC",
+        (nodeid,),
+    ).fetchall()
+
+
+def get_runs(connection, limit=20):
+    """
+    Returns a list of tuples of run id, bucket type, mode, order digest, number of tests and
+    number of failed tests of the last `limit` runs, the latest first.
+    """
+    return connection.execute(
+        "SELECT run_id, bucket_type, mode, order_digest, tests, failed FROM runs ORDER BY id DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+
+
+def get_predecessors(connection, nodeids, runs):
+    """
+    Returns a dictionary of sets of node ids of tests that ran before each of `nodeids`
+    in any of the last `runs` runs, keyed by node id.
+
+    The orders of the last runs are fetched in one query and the predecessors of all tests
+    are collected from them in one pass.
+    """
+    last_run = connection.execute("SELECT MAX(id) FROM runs").fetchone()[0] or 0
+    nodeids_by_id = dict(connection.execute("SELECT id, nodeid FROM tests"))
+    suspects = set(nodeids)
+    orders = {}
+    for run, test, position in connection.execute(
+        "SELECT run, test, position FROM results WHERE run > ? AND position IS NOT NULL", (last_run - runs,)
+    ):
+        orders.setdefault(run, []).append((position, nodeids_by_id[test]))
+
+    predecessors = {nodeid: set() for nodeid in nodeids}
+    for order in orders.values():
+        order.sort()
+        for i, (_, nodeid) in enumerate(order):
+            if nodeid in suspects:
+                predecessors[nodeid].update(earlier for _, earlier in order[:i])
+    return predecessors
+
+
+def load_predecessors(config, nodeids, runs):
+    """
+    Returns `get_predecessors` from the history database in pytest cache,
+    or an empty dictionary if there is no database.
+    """
+    path = get_database_path(config)
+    if not nodeids or path is None or not os.path.isfile(path):
+        return {}
+    with closing(connect(path)) as connection:
+        return get_predecessors(connection, nodeids, runs)
+
+
+class HistoryDatabaseRecorder:
+    """
+    Records the outcome and duration of each test and, at the end of the session,
+    adds the run to the history database.
+
+    A test failed if any of its setup, call or teardown failed, or was skipped if it was not failed and
+    any of them was skipped. With pytest-xdist, the main process does not collect tests, so the order
+    is taken from the plan saved by the first worker.
+    """
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.results = {}
+
+    def pytest_runtest_logreport(self, report):
+        outcome, duration = self.results.get(report.nodeid, ("passed", 0.0))
+        if report.failed:
+            outcome = "failed"
+        elif report.skipped and outcome == "passed":
+            outcome = "skipped"
+        self.results[report.nodeid] = outcome, duration + report.duration
+
+    def pytest_sessionfinish(self, session):
+        if not self.results:
+            return
+        plugin = Config(self.config)
+        with closing(connect(self.path)) as connection:
+            add_run(
+                connection,
+                self.results,
+                self.get_order(session, plugin),
+                run_id=str(plugin.replay if plugin.replay is not None else plugin.run_id),
+                seed=str(plugin.seed),
+                bucket_type=plugin.bucket_type,
+                mode=plugin.mode,
+            )
+
+    def get_order(self, session, plugin):
+        if session.items:
+            return [item.nodeid for item in session.items]
+        if plugin.replay is not None:
+            plan = load_plan(self.config, None if plugin.replay == "last" else plugin.replay)
+        else:
+            plan = load_plan(self.config, plugin.run_id)
+        return plan[1] if plan is not None else list(self.results)
+
+
+def get_database_path(config):
+    """
+    Returns the path of the history database in pytest cache, or None if the cache plugin is disabled.
+    """
+    cache_dir = get_cache_dir(config)
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, DATABASE_FILE_NAME)
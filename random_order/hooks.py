@@ -0,0 +1,16 @@
+"""
+Hooks that other plugins and conftest.py files can implement to take part in the ordering of tests.
+"""
+
+
+def pytest_random_order_bucket_key_overrides(session, config, items):
+    """
+    Called once per test session before test items are shuffled.
+
+    Return a mapping of test node ids to bucket keys (or None). Tests listed in the mapping
+    are placed in the given buckets instead of the ones calculated for the chosen bucket type.
+    Tests put in the same bucket are shuffled together.
+
+    All mappings returned by implementations of this hook are merged into one before shuffling,
+    so overriding keys costs a single dictionary lookup per test no matter how many plugins do it.
+    """
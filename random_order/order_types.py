@@ -0,0 +1,311 @@
+import math
+import random
+from array import array
+from collections import OrderedDict
+
+from random_order.cache import load_durations, load_failures
+from random_order.config import Config
+from random_order.history import load_predecessors
+from random_order.replay import load_plan
+
+order_types = OrderedDict()
+
+
+def order_type(name):
+    """
+    Registers a class that decides the order of buckets and the order of items within buckets.
+
+    The class is instantiated once per session with pytest config (or None when used
+    outside of a pytest run) and must provide two methods which are called for every bucket
+    with the bucket key, a mutable sequence of indices of items in the bucket, the list of all items,
+    and the `random.Random` instance of the bucket:
+
+    ``rank_bucket(key, indices, items, rng)`` returns a value by which buckets are sorted,
+    ``shuffle_bucket(key, indices, items, rng)`` reorders `indices` in place.
+
+    It may also override ``sort_buckets(ranks)`` of `ShuffleOrder` which turns the list of ranks
+    of all buckets into the order of buckets.
+    """
+
+    def decorator(cls):
+        order_types[name] = cls
+        return cls
+
+    return decorator
+
+
+@order_type("shuffle")
+class ShuffleOrder:
+    """
+    Buckets and items within buckets are shuffled uniformly.
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+
+    def rank_bucket(self, key, indices, items, rng):
+        return rng.random()
+
+    def shuffle_bucket(self, key, indices, items, rng):
+        rng.shuffle(indices)
+
+    def sort_buckets(self, ranks):
+        """
+        Returns the list of positions in `ranks` in the order in which the buckets with these ranks run.
+        """
+        return sorted(range(len(ranks)), key=ranks.__getitem__)
+
+
+@order_type("balanced")
+class BalancedOrder(ShuffleOrder):
+    """
+    Buckets that took longer to run last time go first so that, when tests are distributed
+    by pytest-xdist, the tail of the run consists of short tests and all workers finish at about
+    the same time.
+
+    Buckets whose durations are within a factor of two of each other are in the same duration class
+    and are shuffled among themselves, items within buckets are shuffled as usual.
+    """
+
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.durations = load_durations(config) if config is not None else {}
+        known = sorted(self.durations.values())
+        # Tests that have not run before are assumed to take as long as a typical test.
+        self.default_duration = known[len(known) // 2] if known else 0.0
+
+    def rank_bucket(self, key, indices, items, rng):
+        duration = sum(self.get_duration(items[i]) for i in indices)
+        return -_get_duration_class(duration), rng.random()
+
+    def get_duration(self, item):
+        return self.durations.get(getattr(item, "nodeid", None), self.default_duration)
+
+
+def _get_duration_class(duration):
+    if duration <= 0:
+        return -math.inf
+    return math.frexp(duration)[1]
+
+
+@order_type("weighted")
+class WeightedOrder(BalancedOrder):
+    """
+    Tests which failed more often in previous runs and which take less time are more likely to run earlier,
+    so that failures are found sooner, but the order is still random and differs with the seed.
+
+    Each test's weight is its probability of failing divided by its duration, and tests are ordered
+    by weighted random sampling without replacement (sorting on exponentially distributed keys
+    with the weights as rates). Buckets are ordered in the same way by the probability that
+    any of their tests fails divided by their duration.
+    """
+
+    # Shortest duration taken into account, so that weights of very fast tests stay finite.
+    MIN_DURATION = 0.001
+
+    # A test that has not run before is assumed to fail with probability PRIOR_FAILURES / PRIOR_RUNS,
+    # the more runs it has, the less this assumption matters.
+    PRIOR_FAILURES = 0.1
+    PRIOR_RUNS = 1.0
+
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.failures = load_failures(config) if config is not None else {}
+
+    def rank_bucket(self, key, indices, items, rng):
+        passes = 1.0
+        duration = 0.0
+        for i in indices:
+            passes *= 1.0 - self.get_failure_probability(items[i])
+            duration += self.get_duration(items[i])
+        return rng.expovariate((1.0 - passes) / max(duration, self.MIN_DURATION))
+
+    def shuffle_bucket(self, key, indices, items, rng):
+        ranks = {i: rng.expovariate(self.get_weight(items[i])) for i in indices}
+        indices[:] = array("l", sorted(indices, key=ranks.__getitem__))
+
+    def get_weight(self, item):
+        return self.get_failure_probability(item) / max(self.get_duration(item), self.MIN_DURATION)
+
+    def get_failure_probability(self, item):
+        runs, failures = self.failures.get(getattr(item, "nodeid", None), (0, 0))
+        return (failures + self.PRIOR_FAILURES) / (runs + self.PRIOR_RUNS)
+
+
+@order_type("guided")
+class GuidedOrder(ShuffleOrder):
+    """
+    Tests which both passed and failed in previous runs are suspected of depending on the order of tests,
+    and run after tests which they have not run after in the last `HISTORY_RUNS` runs (according to
+    `random_order.history`), so that every run either exposes or rules out new predecessors of them.
+
+    Within a bucket with suspects, tests which any of them has not run after go first, the other tests
+    and the suspects are shuffled after them. Buckets with tests which a suspect of another bucket
+    has not run after go first, each group of buckets shuffled.
+    """
+
+    HISTORY_RUNS = 50
+
+    def __init__(self, config=None):
+        super().__init__(config)
+        failures = load_failures(config) if config is not None else {}
+        self.suspects = set(nodeid for nodeid, (runs, failed) in failures.items() if 0 < failed < runs)
+        self.predecessors = load_predecessors(config, self.suspects, self.HISTORY_RUNS) if config is not None else {}
+        self._collected_suspects = None
+
+    def rank_bucket(self, key, indices, items, rng):
+        if self._collected_suspects is None:
+            self._collected_suspects = set(item.nodeid for item in items if self.is_suspect(item))
+        if self._collected_suspects:
+            others = self._collected_suspects.difference(items[i].nodeid for i in indices)
+            if any(self.is_new_predecessor(items[i], others) for i in indices):
+                return 0, rng.random()
+        return 1, rng.random()
+
+    def shuffle_bucket(self, key, indices, items, rng):
+        rng.shuffle(indices)
+        suspects = [items[i].nodeid for i in indices if self.is_suspect(items[i])]
+        if suspects:
+            new = {i: self.is_new_predecessor(items[i], suspects) for i in indices}
+            indices[:] = array("l", sorted(indices, key=lambda i: not new[i]))
+
+    def is_suspect(self, item):
+        return getattr(item, "nodeid", None) in self.suspects
+
+    def is_new_predecessor(self, item, suspects):
+        """
+        Returns True if any of `suspects` (node ids) other than `item` itself has not run after `item`
+        in the last runs.
+        """
+        return any(
+            item.nodeid not in self.predecessors.get(suspect, ()) for suspect in suspects if suspect != item.nodeid
+        )
+
+
+@order_type("derange")
+class DerangeOrder(ShuffleOrder):
+    """
+    No test runs right after the test it ran after in the last run, and no bucket right after
+    the bucket it ran after, so that every run tries new pairs of adjacent tests.
+
+    Buckets, and tests within buckets, that ran in the last run are put in the order of the last run
+    and then rearranged with `get_derangement`. Buckets and tests that did not run in the last run
+    are inserted at random positions, which does not give any test its previous predecessor back.
+    The guarantee holds when the last run used the same bucket type and for buckets which are shuffled
+    (not those of ``--failed-first`` and disabled by the ``random_order`` marker).
+    """
+
+    def __init__(self, config=None, previous=None):
+        super().__init__(config)
+        if previous is None and config is not None:
+            if hasattr(config, "workerinput") and "random_order_previous_order" in config.workerinput:
+                # pytest-xdist: use the order loaded on main, the first worker saves the new one meanwhile.
+                previous = config.workerinput["random_order_previous_order"]
+            else:
+                plan = load_plan(config)
+                previous = plan[1] if plan is not None else ()
+        self.positions = {nodeid: i for i, nodeid in enumerate(previous or ())}
+        self.rng = random.Random("{0}:derange".format(Config(config).seed if config is not None else None))
+
+    def rank_bucket(self, key, indices, items, rng):
+        positions = [self.positions[items[i].nodeid] for i in indices if items[i].nodeid in self.positions]
+        return min(positions) if positions else math.inf, rng.random()
+
+    def shuffle_bucket(self, key, indices, items, rng):
+        ranks = [(self.positions.get(items[i].nodeid, math.inf), rng.random()) for i in indices]
+        indices[:] = array("l", (indices[i] for i in self._derange(ranks, rng)))
+
+    def sort_buckets(self, ranks):
+        return self._derange(ranks, self.rng)
+
+    def _derange(self, ranks, rng):
+        """
+        Returns the list of positions in `ranks`, tuples of the previous position (or infinity if none)
+        and a random number, in the new order.
+        """
+        previous = sorted((i for i, rank in enumerate(ranks) if rank[0] != math.inf), key=ranks.__getitem__)
+        deranged = [previous[i] for i in get_derangement(len(previous), rng)]
+        # New ones are inserted before the deranged one at a position given by their random number.
+        slots = {i: j for j, i in enumerate(deranged)}
+        for i, rank in enumerate(ranks):
+            if rank[0] == math.inf:
+                slots[i] = int(rank[1] * (len(deranged) + 1)) - 0.5
+        return sorted(slots, key=lambda i: (slots[i], ranks[i][1]))
+
+
+def get_derangement(n, rng):
+    """
+    Returns an order of ``range(n)`` in which no number runs right after the number right before it
+    in ``range(n)``, with numbers moved far from their positions.
+
+    The order takes every `s`-th number from a random starting point, wrapping around, where `s` is
+    a random stride of about half of `n` coprime with `n`, so every number is taken exactly once and
+    the number before `i` is ``i - s`` (modulo `n`), which is not ``i - 1`` unless `s` is 1,
+    which only happens for ``n == 2``, in which case the order is reversed.
+    """
+    if n < 2:
+        return list(range(n))
+    if n == 2:
+        return [1, 0]
+    stride = max(2, rng.randint(n // 3, 2 * n // 3))
+    while math.gcd(stride, n) != 1:
+        stride += 1
+    start = rng.randrange(n)
+    return [(start + j * stride) % n for j in range(n)]
+
+
+@order_type("covering")
+class CoveringOrder(ShuffleOrder):
+    """
+    Over a sequence of runs with the same seed, every test runs immediately before every other test
+    of its bucket, and every bucket immediately before every other bucket, in as few runs as possible.
+
+    Buckets and items within buckets are numbered in a random order derived from the seed and
+    each run (identified by its index, see ``--random-order-run-index``) takes the next of
+    the orders returned by `get_covering_order`.
+    """
+
+    def __init__(self, config=None, run_index=None):
+        super().__init__(config)
+        if run_index is None and config is not None:
+            run_index = config.getoption("random_order_run_index")
+        self.run_index = run_index or 0
+
+    def shuffle_bucket(self, key, indices, items, rng):
+        labels = list(indices)
+        rng.shuffle(labels)
+        indices[:] = array("l", (labels[i] for i in get_covering_order(len(labels), self.run_index)))
+
+    def sort_buckets(self, ranks):
+        labels = super().sort_buckets(ranks)
+        return [labels[i] for i in get_covering_order(len(labels), self.run_index)]
+
+
+def get_covering_order(n, run_index):
+    """
+    Returns the order of ``range(n)`` for run `run_index`, such that every ordered pair of distinct
+    numbers is adjacent in at least one of the orders of any `get_covering_period(n)` consecutive runs.
+
+    The orders are Walecki's zigzag Hamiltonian paths, which split the complete graph on an even number
+    of vertices into paths with no edges in common, each path followed by its reverse.
+    For odd `n`, a vertex is added and then left out of the paths.
+    """
+    if n < 2:
+        return list(range(n))
+    m = get_covering_period(n)
+    start = (run_index // 2) % (m // 2)
+    path = [start]
+    for step in range(1, m // 2):
+        path.append((start + step) % m)
+        path.append((start - step) % m)
+    path.append((start + m // 2) % m)
+    if run_index % 2:
+        path.reverse()
+    return [i for i in path if i < n]
+
+
+def get_covering_period(n):
+    """
+    Returns the number of runs after which `get_covering_order` starts repeating itself.
+    """
+    return n + n % 2
@@ -1,3 +1,4 @@
+import os
 import random
 import sys
 import traceback
@@ -5,13 +6,31 @@ import warnings
 
 import pytest
 
-from random_order.bucket_types import bucket_type_keys, bucket_types
-from random_order.cache import process_failed_first_last_failed
+from random_order import hooks
+from random_order.bisection import Bisection
+from random_order.bucket_types import bucket_type_option, bucket_types, compile_bucket_key, get_bucket_key
+from random_order.cache import (
+    RUN_INDEX_CACHE_KEY,
+    HistoryRecorder,
+    process_failed_first_last_failed,
+    process_new_first,
+)
 from random_order.config import Config
-from random_order.shuffler import _disable, _get_set_of_item_ids, _shuffle_items
+from random_order.fixtures import count_fixture_setups
+from random_order.history import HistoryDatabaseRecorder, get_database_path
+from random_order.order_types import order_types
+from random_order.profile import NullProfile, Profile
+from random_order.replay import apply_plan, load_plan, save_plan
+from random_order.selection import load_durations_file, sample_items, sample_size_option, shard_items, shard_option
+from random_order.shuffler import _disable, _find_lost_items, _shuffle_items
+from random_order.sweep import Sweep, derive_seeds
 from random_order.xdist import XdistHooks
 
 
+def pytest_addhooks(pluginmanager):
+    pluginmanager.add_hookspecs(hooks)
+
+
 def pytest_addoption(parser):
     group = parser.getgroup("pytest-random-order options")
     group.addoption(
@@ -25,16 +44,138 @@ def pytest_addoption(parser):
         action="store",
         dest="random_order_bucket",
         default=Config.default_value("module"),
-        choices=bucket_types,
-        help="Randomise test order within specified test buckets.",
+        type=bucket_type_option,
+        metavar="{{{0}}}".format(",".join(bucket_types)),
+        help="Randomise test order within specified test buckets. "
+        "Several bucket types separated by '/', for example 'package/module/class', shuffle buckets "
+        "at each level within the buckets of the level before it.",
     )
     group.addoption(
         "--random-order-seed",
         action="store",
         dest="random_order_seed",
-        default=Config.default_value(str(random.randint(1, 1000000))),
+        default=Config.default_value(str(random.Random().randint(1, 1000000))),
         help="Randomise test order using a specific seed.",
     )
+    group.addoption(
+        "--random-order-mode",
+        action="store",
+        dest="random_order_mode",
+        default=Config.default_value("shuffle"),
+        choices=order_types.keys(),
+        help="Choose how buckets and tests within buckets are ordered, "
+        "'balanced' runs buckets that took longer last time first, "
+        "'covering' runs every test right before every other test of its bucket over a number of runs, "
+        "'guided' runs tests which passed and failed in previous runs after tests they have not run after, "
+        "'derange' runs no test right after the test it ran after in the last run, "
+        "'weighted' runs tests that failed more often and take less time earlier.",
+    )
+    group.addoption(
+        "--random-order-run-index",
+        action="store",
+        dest="random_order_run_index",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Index of the run in the sequence of orders of --random-order-mode=covering "
+        "(by default, the previous run's plus one).",
+    )
+    group.addoption(
+        "--random-order-sample",
+        action="store",
+        dest="random_order_sample",
+        type=sample_size_option,
+        default=None,
+        metavar="COUNT|PERCENT%",
+        help="Run only a random sample of tests of this size, selected in proportion to the sizes "
+        "of buckets, and deselect the others. The sample is reproducible with --random-order-seed.",
+    )
+    group.addoption(
+        "--random-order-shard",
+        action="store",
+        dest="random_order_shard",
+        type=shard_option,
+        default=None,
+        metavar="I/N",
+        help="Split tests into N shards of similar duration (by --random-order-durations, "
+        "or of similar number of tests without it) without splitting buckets, and run only shard I (from 1 to N).",
+    )
+    group.addoption(
+        "--random-order-durations",
+        action="store",
+        dest="random_order_durations",
+        default=None,
+        metavar="JSON_PATH",
+        help="JSON file of test durations in seconds keyed by node id, which all machines running "
+        "shards of --random-order-shard share, for example the random_order/durations file "
+        "recorded in pytest cache.",
+    )
+    group.addoption(
+        "--random-order-replay",
+        action="store_true",
+        dest="random_order_replay",
+        help="Run tests in exactly the order saved by the last run. Tests that did not exist then run last.",
+    )
+    group.addoption(
+        "--random-order-replay-run",
+        action="store",
+        dest="random_order_replay_run",
+        default=None,
+        metavar="RUN_ID",
+        help="Run tests in exactly the order saved by a previous run, identified by its seed, "
+        "or in the order of a plan file. Tests that did not exist then run last.",
+    )
+    group.addoption(
+        "--random-order-history",
+        action="store_true",
+        dest="random_order_history",
+        help="Record the order and outcome of every test in the history database in pytest cache "
+        "(see python -m random_order). Always on with --random-order-mode=guided.",
+    )
+    group.addoption(
+        "--random-order-profile",
+        action="store_true",
+        dest="random_order_profile",
+        help="Report the time the plugin spent on each phase of ordering tests in the terminal summary.",
+    )
+    group.addoption(
+        "--random-order-profile-json",
+        action="store",
+        dest="random_order_profile_json",
+        default=None,
+        metavar="JSON_PATH",
+        help="Report the time the plugin spent on each phase of ordering tests in the terminal summary "
+        "and write it to a JSON file (a new file or a .json file, which is overwritten).",
+    )
+    group.addoption(
+        "--random-order-bisect",
+        action="store",
+        dest="random_order_bisect",
+        default=None,
+        metavar="NODEID",
+        help="Instead of running tests, find the tests which make test NODEID fail when run before it "
+        "in the order of this run (use with --random-order-seed, --random-order-replay or --random-order-replay-run).",
+    )
+    group.addoption(
+        "--random-order-sweep",
+        action="store",
+        dest="random_order_sweep",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Instead of running tests once, run them in N random orders with seeds derived from "
+        "--random-order-seed and report which tests failed with which seeds.",
+    )
+    group.addoption(
+        "--random-order-workers",
+        action="store",
+        dest="random_order_workers",
+        type=int,
+        default=os.cpu_count(),
+        metavar="N",
+        help="Number of pytest processes to run at a time with --random-order-bisect "
+        "and --random-order-sweep (default: number of CPUs).",
+    )
 
 
 def pytest_configure(config):
@@ -45,6 +186,25 @@ def pytest_configure(config):
     if config.pluginmanager.hasplugin("xdist"):
         config.pluginmanager.register(XdistHooks())
 
+    if config.getoption("random_order_bisect") and config.getoption("random_order_sweep"):
+        raise pytest.UsageError("--random-order-bisect and --random-order-sweep cannot be used together")
+    for name in ("bisect", "sweep"):
+        if config.getoption("random_order_" + name) and getattr(config.option, "numprocesses", None):
+            raise pytest.UsageError("--random-order-{0} cannot be used with pytest-xdist -n".format(name))
+
+    plugin = Config(config)
+    if plugin.profile and os.path.exists(plugin.profile) and not plugin.profile.endswith(".json"):
+        raise pytest.UsageError(
+            "--random-order-profile-json: refusing to overwrite {0}, which is not a .json file".format(plugin.profile)
+        )
+
+    if plugin.is_enabled and plugin.bucket_type != "none" and plugin.replay is None:
+        # The plugin puts new tests first itself (see `process_new_first`), pytest would instead
+        # sort all tests by modification time of their files after the plugin has shuffled them.
+        nfplugin = config.pluginmanager.getplugin("nfplugin")
+        if nfplugin is not None and getattr(nfplugin, "active", False):
+            nfplugin.active = False
+
     if hasattr(config, "workerinput"):
         # pytest-xdist: use seed generated on main.
         seed = config.workerinput["random_order_seed"]
@@ -52,39 +212,218 @@ def pytest_configure(config):
             assert config.cache is not None
             config.cache.set("random_order_seed", seed)
         config.option.random_order_seed = seed
+        config.option.random_order_run_index = config.workerinput.get("random_order_run_index")
+
+    elif Config(config).is_enabled and getattr(config, "cache", None) is not None:
+        config.pluginmanager.register(HistoryRecorder(config), "random_order_history")
+        if config.getoption("random_order_history") or Config(config).mode == "guided":
+            config.pluginmanager.register(
+                HistoryDatabaseRecorder(config, get_database_path(config)), "random_order_history_database"
+            )
+        if Config(config).mode == "covering" and config.getoption("random_order_run_index") is None:
+            run_index = config.cache.get(RUN_INDEX_CACHE_KEY, -1) + 1
+            config.cache.set(RUN_INDEX_CACHE_KEY, run_index)
+            config.option.random_order_run_index = run_index
 
 
 def pytest_report_header(config):
     plugin = Config(config)
     if not plugin.is_enabled:
         return "Test order randomisation NOT enabled. Enable with --random-order or --random-order-bucket=<bucket_type>"
-    return ("Using --random-order-bucket={plugin.bucket_type}\nUsing --random-order-seed={plugin.seed}\n").format(
+    if plugin.replay is not None:
+        return "Using {0}\n".format(_format_replay_option(plugin.replay))
+    header = ("Using --random-order-bucket={plugin.bucket_type}\nUsing --random-order-seed={plugin.seed}\n").format(
         plugin=plugin
     )
+    if plugin.mode != "shuffle":
+        header += "Using --random-order-mode={plugin.mode}\n".format(plugin=plugin)
+    if plugin.shard is not None:
+        header += "Using --random-order-shard={plugin.shard}\n".format(plugin=plugin)
+    if plugin.sample is not None:
+        header += "Using --random-order-sample={plugin.sample}\n".format(plugin=plugin)
+    if plugin.run_index is not None:
+        header += "Using --random-order-run-index={plugin.run_index}\n".format(plugin=plugin)
+    return header
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    for name in ("random_order_bisection", "random_order_sweep"):
+        result = getattr(config, name, None)
+        if result is not None:
+            for line in result.format_lines():
+                terminalreporter.write_line(line)
+
+    profile = getattr(config, "random_order_profile", None)
+    if profile is not None:
+        terminalreporter.write_line(profile.format_line())
+
+    fixture_setups = getattr(config, "random_order_fixture_setups", None)
+    if fixture_setups:
+        setups, module_setups = fixture_setups
+        terminalreporter.write_line(
+            "random-order: {0} higher-scoped fixture setups, {1} with --random-order-bucket=module".format(
+                setups, module_setups
+            )
+        )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session):
+    config = session.config
+    if config.getoption("collectonly"):
+        return None
+
+    sweep = config.getoption("random_order_sweep")
+    if sweep:
+        seeds = derive_seeds(Config(config).seed, sweep)
+        config.random_order_sweep = result = Sweep(
+            config, seeds, workers=config.getoption("random_order_workers")
+        ).run()
+        session.testsfailed = len(result.failed_seeds)
+        return True
+
+    target = config.getoption("random_order_bisect")
+    if not target:
+        return None
+
+    try:
+        bisection = Bisection(config, session.items, target, workers=config.getoption("random_order_workers"))
+    except ValueError:
+        raise pytest.UsageError("--random-order-bisect: test {0} was not collected".format(target))
+    config.random_order_bisection = bisection.run()
+    return True
+
+
+def pytest_random_order_bucket_key_overrides(session, config, items):
+    overrides = process_new_first(session, config, items)
+    overrides.update(process_failed_first_last_failed(session, config, items))
+    return overrides
 
 
 def pytest_collection_modifyitems(session, config, items):
     failure = None
 
-    session.random_order_bucket_type_key_handlers = []
-    process_failed_first_last_failed(session, config, items)
+    plugin = Config(config)
+    profile = Profile() if plugin.profile is not None else NullProfile()
+    profile.count("items", len(items))
 
-    item_ids = _get_set_of_item_ids(items)
+    session.random_order_bucket_type_key_handlers = []
+    session.random_order_disabled_cache = {}
+    session.random_order_fixture_components = None
+    overrides = {}
+    with profile.phase("overrides"):
+        for plugin_overrides in reversed(
+            config.hook.pytest_random_order_bucket_key_overrides(session=session, config=config, items=items)
+        ):
+            if plugin_overrides:
+                overrides.update(plugin_overrides)
+    profile.count("overrides", len(overrides))
 
-    plugin = Config(config)
+    original_items = list(items)
 
     try:
         seed = plugin.seed
         bucket_type = plugin.bucket_type
+
+        if plugin.replay is not None:
+            with profile.phase("replay"):
+                if hasattr(config, "workerinput") and "random_order_plan" in config.workerinput:
+                    # pytest-xdist: use the plan loaded on main.
+                    plan = config.workerinput["random_order_plan"]
+                else:
+                    plan = load_plan(config, None if plugin.replay == "last" else plugin.replay)
+                if plan is None:
+                    raise pytest.UsageError(
+                        "pytest-random-order: no saved test order found for {0}".format(
+                            _format_replay_option(plugin.replay)
+                        )
+                    )
+                deselected = apply_plan(items, plan[1], exclusive=plan[0].get("exclusive", False))
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+                original_items = list(items)
+            return
+
+        bucket_key = None
         if bucket_type != "none":
-            _shuffle_items(
-                items,
-                bucket_key=bucket_type_keys[bucket_type],
-                disable=_disable,
-                seed=seed,
-                session=session,
+            bucket_key = compile_bucket_key(
+                get_bucket_key(bucket_type), overrides, session.random_order_bucket_type_key_handlers
             )
 
+        if plugin.shard is not None:
+            with profile.phase("shard"):
+                durations = _load_shard_durations(plugin)
+                selected, deselected = shard_items(
+                    items,
+                    plugin.shard,
+                    lambda item: durations.get(item.nodeid, 0.0),
+                    # Every machine must split shards in the same way, so bucket keys of the split are not
+                    # overridden (by --failed-first and --new-first which depend on the machine's cache).
+                    # Tests of global (or no) buckets can be split between shards one by one.
+                    bucket_key=(
+                        compile_bucket_key(get_bucket_key(bucket_type))
+                        if bucket_type not in ("global", "none")
+                        else _get_nodeid_key
+                    ),
+                    disable=_disable,
+                    seed=seed,
+                    session=session,
+                )
+            items[:] = selected
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+            original_items = list(items)
+
+        if plugin.sample is not None:
+            with profile.phase("sample"):
+                selected, deselected = sample_items(
+                    items, plugin.sample, bucket_key=bucket_key, disable=_disable, seed=seed, session=session
+                )
+            if deselected:
+                items[:] = selected
+                config.hook.pytest_deselected(items=deselected)
+                original_items = list(items)
+
+        if bucket_type != "none":
+            with profile.phase("shuffle"):
+                _shuffle_items(
+                    items,
+                    bucket_key=profile.wrap("keys", bucket_key),
+                    disable=profile.wrap("disable", _disable),
+                    seed=seed,
+                    session=session,
+                    order=order_types[plugin.mode](config),
+                )
+            profile.count("disable parents", len(session.random_order_disabled_cache))
+            if _is_main_or_first_worker(config):
+                with profile.phase("save plan"):
+                    save_plan(
+                        config,
+                        plugin.run_id,
+                        [item.nodeid for item in items],
+                        seed=seed,
+                        bucket_type=bucket_type,
+                        mode=plugin.mode,
+                        run_index=plugin.run_index,
+                        # Tests do not run in this order with --random-order-sweep and --random-order-bisect.
+                        last=not (config.getoption("random_order_sweep") or config.getoption("random_order_bisect")),
+                    )
+
+        if bucket_type == "fixture":
+            with profile.phase("fixture setups"):
+                module_items = list(items)
+                _shuffle_items(
+                    module_items,
+                    bucket_key=compile_bucket_key(get_bucket_key("module")),
+                    disable=_disable,
+                    seed=seed,
+                    session=session,
+                )
+                config.random_order_fixture_setups = (count_fixture_setups(items), count_fixture_setups(module_items))
+
+    except pytest.UsageError:
+        raise
+
     except Exception as e:
         # See the finally block -- we only fail if we have lost user's tests.
         _, _, exc_tb = sys.exc_info()
@@ -98,7 +437,54 @@ def pytest_collection_modifyitems(session, config, items):
 
     finally:
         # Fail only if we have lost user's tests
-        if item_ids != _get_set_of_item_ids(items):
+        with profile.phase("integrity"):
+            lost, duplicated = _find_lost_items(original_items, items)
+        if plugin.profile is not None:
+            _report_profile(config, plugin, profile)
+        if lost or duplicated:
             if not failure:
                 failure = "pytest-random-order plugin has failed miserably"
-            raise RuntimeError(failure)
+            raise RuntimeError(failure + _format_lost_items(lost, duplicated))
+
+
+def _report_profile(config, plugin, profile):
+    config.random_order_profile = profile
+    if plugin.profile and _is_main_or_first_worker(config):
+        profile.write_json(plugin.profile, seed=plugin.seed, bucket_type=plugin.bucket_type, mode=plugin.mode)
+
+
+def _load_shard_durations(plugin):
+    # Every machine must split shards by the same durations, so those recorded
+    # in the machine's own cache (of the shards it ran) are not used.
+    if plugin.durations is None:
+        return {}
+    try:
+        return load_durations_file(plugin.durations)
+    except (IOError, ValueError) as e:
+        raise pytest.UsageError("--random-order-durations: cannot read {0}: {1}".format(plugin.durations, e))
+
+
+def _format_replay_option(replay):
+    if replay == "last":
+        return "--random-order-replay"
+    return "--random-order-replay-run={0}".format(replay)
+
+
+def _get_nodeid_key(item, session):
+    return item.nodeid
+
+
+def _is_main_or_first_worker(config):
+    # All pytest-xdist workers order tests the same way, only one of them needs to save the order.
+    return not hasattr(config, "workerinput") or config.workerinput.get("workerid") in (None, "gw0")
+
+
+def _format_lost_items(lost, duplicated, limit=10):
+    lines = []
+    for title, nodeids in (("Lost tests", lost), ("Duplicated tests", duplicated)):
+        if nodeids:
+            lines.append("\n{0}:".format(title))
+            lines.extend("\n  {0}".format(nodeid) for nodeid in nodeids[:limit])
+            if len(nodeids) > limit:
+                lines.append("\n  ... and {0} more".format(len(nodeids) - limit))
+    return "".join(lines)
@@ -0,0 +1,97 @@
+"""
+Timings and counters of the work the plugin does during collection, for ``--random-order-profile``.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Profile:
+    """
+    Accumulates the time spent in named phases and named counters, in the order they were first seen.
+    Phases can be nested, the time of nested phases is not included in the time of the enclosing phase.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.counters = OrderedDict()
+        # Time spent in nested phases of each phase being timed.
+        self._nested = []
+
+    @contextmanager
+    def phase(self, name):
+        self.timings.setdefault(name, 0.0)
+        self._nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add_time(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrap(self, name, f):
+        """
+        Returns a function which calls `f`, counting the calls and adding the time they take to phase `name`.
+        """
+        perf_counter = time.perf_counter
+        timings = self.timings
+        counters = self.counters
+        nested = self._nested
+        timings.setdefault(name, 0.0)
+        calls = "{0} calls".format(name)
+        counters.setdefault(calls, 0)
+
+        def wrapped(*args):
+            started = perf_counter()
+            try:
+                return f(*args)
+            finally:
+                elapsed = perf_counter() - started
+                timings[name] += elapsed
+                counters[calls] += 1
+                if nested:
+                    nested[-1] += elapsed
+
+        return wrapped
+
+    def format_line(self):
+        phases = ", ".join("{0} {1:.1f} ms".format(name, seconds * 1000) for name, seconds in self.timings.items())
+        counters = ", ".join("{0} {1}".format(name, value) for name, value in self.counters.items())
+        return "random-order profile: {0:.1f} ms ({1}); {2}".format(self.total * 1000, phases, counters)
+
+    def write_json(self, path, **info):
+        with open(path, "w") as f:
+            json.dump(dict(info, total=self.total, timings=self.timings, counters=self.counters), f, indent=2)
+
+
+class NullProfile:
+    """
+    Stands in for `Profile` when profiling is off and does nothing.
+    """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def wrap(self, name, f):
+        return f
@@ -0,0 +1,115 @@
+"""
+Saving of the final order of tests in pytest cache and replaying it with ``--random-order-replay`` and ``--random-order-replay-run``.
+
+Each plan is a gzip-compressed text file in the plugin's cache directory. The first line is
+a JSON header (run id, seed, bucket type), each following line is a test node id.
+The run id of a plan is the seed it was produced with.
+
+A plan can also be written to any other file with `write_plan` and replayed by passing its path
+to ``--random-order-replay-run``. Such plans may be exclusive, in which case tests not in the plan are deselected.
+"""
+
+import gzip
+import json
+import os
+
+from random_order.cache import get_cache_dir
+
+PLANS_DIR_NAME = "plans"
+LAST_PLAN_FILE_NAME = "last"
+MAX_PLANS = 32
+
+
+def save_plan(config, run_id, nodeids, last=True, **info):
+    """
+    Saves `nodeids` as the plan of run `run_id` and, if `last` is True, makes it the last plan.
+    `info` is stored in the header of the plan.
+    """
+    plans_dir = get_cache_dir(config, PLANS_DIR_NAME)
+    if plans_dir is None:
+        return
+
+    write_plan(get_plan_path(plans_dir, run_id), nodeids, run_id=str(run_id), **info)
+
+    if last:
+        with open(os.path.join(plans_dir, LAST_PLAN_FILE_NAME), "w") as f:
+            f.write(str(run_id))
+
+    _remove_old_plans(plans_dir)
+
+
+def write_plan(path, nodeids, **info):
+    """
+    Writes a plan of `nodeids` to the file at `path`. `info` is stored in the header of the plan.
+    """
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(info))
+        for nodeid in nodeids:
+            f.write("\n")
+            f.write(nodeid)
+
+
+def load_plan(config, run_id=None):
+    """
+    Returns a tuple of the header and the list of node ids of the plan of run `run_id`
+    (or of the last run if `run_id` is None), or None if there is no such plan.
+    `run_id` can also be the path of a plan file written by `write_plan`.
+    """
+    if run_id is not None and os.path.isfile(run_id):
+        return read_plan(run_id)
+
+    plans_dir = get_cache_dir(config, PLANS_DIR_NAME)
+    if plans_dir is None:
+        return None
+
+    if run_id is None:
+        try:
+            with open(os.path.join(plans_dir, LAST_PLAN_FILE_NAME)) as f:
+                run_id = f.read().strip()
+        except IOError:
+            return None
+
+    return read_plan(get_plan_path(plans_dir, run_id))
+
+
+def apply_plan(items, nodeids, exclusive=False):
+    """
+    Reorders `items` in place to follow the order of `nodeids`.
+    Items not in `nodeids` (tests added since the plan was saved) go last, in their current order,
+    or, if `exclusive` is True, are removed from `items`. Returns the list of removed items.
+    """
+    positions = {nodeid: i for i, nodeid in enumerate(nodeids)}
+    unknown = len(positions)
+    deselected = []
+    if exclusive:
+        deselected = [item for item in items if item.nodeid not in positions]
+        items[:] = [item for item in items if item.nodeid in positions]
+    items.sort(key=lambda item: positions.get(item.nodeid, unknown))
+    return deselected
+
+
+def read_plan(path):
+    """
+    Returns a tuple of the header and the list of node ids of the plan in file `path`, or None if there is no such file.
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+    except IOError:
+        return None
+
+    return json.loads(lines[0]), lines[1:]
+
+
+def get_plan_path(plans_dir, run_id):
+    safe_run_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(run_id))
+    return os.path.join(plans_dir, "{0}.txt.gz".format(safe_run_id))
+
+
+def _remove_old_plans(plans_dir):
+    paths = [os.path.join(plans_dir, name) for name in os.listdir(plans_dir) if name.endswith(".txt.gz")]
+    if len(paths) <= MAX_PLANS:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:-MAX_PLANS]:
+        os.remove(path)
@@ -0,0 +1,168 @@
+"""
+Selection of a subset of tests to run, for ``--random-order-sample`` and ``--random-order-shard``.
+"""
+
+import argparse
+import heapq
+import json
+import random
+
+from random_order.shuffler import _bucket_rng, bucket_items
+
+# Duration assumed for tests that took no time or have no known duration, so that such tests
+# are spread across shards by their number.
+MIN_TEST_DURATION = 0.001
+
+
+def sample_size_option(value):
+    """
+    Validates the value of ``--random-order-sample``: a number of tests or a percentage of them.
+    """
+    try:
+        size = parse_sample_size(value)
+    except ValueError:
+        size = None
+    if size is None or size[0] < 0 or size[1] < 0:
+        raise argparse.ArgumentTypeError(
+            "invalid sample size: {0!r} (expected a number of tests like 100 or a percentage like 10%)".format(value)
+        )
+    return value
+
+
+def parse_sample_size(value):
+    """
+    Returns a tuple of the number of tests and the percentage of tests in sample size `value`,
+    one of which is zero.
+    """
+    if value.endswith("%"):
+        return 0, float(value[:-1])
+    return int(value), 0.0
+
+
+def get_sample_count(value, total):
+    """
+    Returns how many of `total` tests a sample of size `value` (see `parse_sample_size`) includes.
+    A sample of a non-zero percentage of a non-empty suite includes at least one test.
+    """
+    count, percent = parse_sample_size(value)
+    if percent:
+        count = max(1, int(round(total * percent / 100.0)))
+    return min(count, total)
+
+
+def sample_items(items, value, bucket_key=None, disable=None, seed=None, session=None):
+    """
+    Returns a tuple of lists of selected and deselected `items`, in their current order,
+    with a sample of size `value` (see `parse_sample_size`) selected.
+
+    The sample is stratified: buckets (see `random_order.shuffler.bucket_items`) get numbers of
+    selected tests proportional to their sizes, by the largest remainder method with ties
+    broken at random, and tests within each bucket are sampled with a random generator
+    derived from `seed` and the bucket key.
+    """
+    count = get_sample_count(value, len(items))
+    if count == len(items):
+        return list(items), []
+
+    buckets = bucket_items(items, bucket_key=bucket_key, disable=disable, session=session)
+    sizes = [len(buckets.members(bucket_id)) for bucket_id in range(len(buckets))]
+    quotas = apportion(count, sizes, random.Random("{0}:sample".format(seed)))
+
+    selected = bytearray(len(items))
+    for bucket_id, quota in enumerate(quotas):
+        members = buckets.members(bucket_id)
+        rng = _bucket_rng("{0}:sample".format(seed), buckets.keys[bucket_id])
+        for i in rng.sample(range(len(members)), quota):
+            selected[members[i]] = 1
+
+    return (
+        [item for item, s in zip(items, selected) if s],
+        [item for item, s in zip(items, selected) if not s],
+    )
+
+
+def apportion(count, sizes, rng):
+    """
+    Splits `count` between groups of `sizes` in proportion to their sizes by the largest remainder method,
+    returns the list of shares. Groups with equal remainders are ordered with `rng`.
+    """
+    total = sum(sizes)
+    if not total:
+        return [0] * len(sizes)
+    exact = [count * size / float(total) for size in sizes]
+    shares = [int(share) for share in exact]
+    by_remainder = sorted(range(len(sizes)), key=lambda i: (shares[i] - exact[i], rng.random()))
+    for i in by_remainder[: count - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def shard_option(value):
+    """
+    Validates the value of ``--random-order-shard``: "i/n" where shard `i` is one of 1 to `n`.
+    """
+    try:
+        shard, shards = parse_shard(value)
+    except ValueError:
+        shard, shards = 0, 0
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(
+            "invalid shard: {0!r} (expected i/n where i is from 1 to n, for example 1/4)".format(value)
+        )
+    return value
+
+
+def parse_shard(value):
+    """
+    Returns a tuple of the shard number (starting from 1) and the number of shards of shard `value`.
+    """
+    shard, shards = value.split("/")
+    return int(shard), int(shards)
+
+
+def load_durations_file(path):
+    """
+    Returns the dictionary of test durations in seconds keyed by node id in JSON file `path`,
+    for ``--random-order-durations``.
+    """
+    with open(path) as f:
+        durations = json.load(f)
+    if not isinstance(durations, dict) or not all(isinstance(d, (int, float)) for d in durations.values()):
+        raise ValueError("expected an object of durations in seconds keyed by node id")
+    return durations
+
+
+def shard_items(items, value, get_duration, bucket_key=None, disable=None, seed=None, session=None):
+    """
+    Returns a tuple of lists of selected and deselected `items`, in their current order,
+    with the tests of shard `value` (see `parse_shard`) selected.
+
+    Whole buckets (see `random_order.shuffler.bucket_items`) are assigned to shards so that
+    the total durations of shards, as returned by `get_duration` for each item, are as close
+    as possible: the longest bucket goes to the shard with the least total duration so far,
+    then the next longest and so on. Buckets of equal duration are taken in a random order
+    derived from `seed` and their keys, so every shard is the same as long as `items`,
+    the durations and the seed are.
+    """
+    shard, shards = parse_shard(value)
+    buckets = bucket_items(items, bucket_key=bucket_key, disable=disable, session=session)
+
+    ranks = []
+    for bucket_id in range(len(buckets)):
+        duration = sum(max(get_duration(items[i]), MIN_TEST_DURATION) for i in buckets.members(bucket_id))
+        ranks.append((-duration, _bucket_rng("{0}:shard".format(seed), buckets.keys[bucket_id]).random()))
+
+    # Total duration and number of each shard, the shard with the least total duration on top.
+    loads = [(0.0, i) for i in range(shards)]
+    selected = bytearray(len(items))
+    for bucket_id in sorted(range(len(buckets)), key=ranks.__getitem__):
+        load, lightest = heapq.heappop(loads)
+        heapq.heappush(loads, (load - ranks[bucket_id][0], lightest))
+        if lightest == shard - 1:
+            for i in buckets.members(bucket_id):
+                selected[i] = 1
+
+    return (
+        [item for item, s in zip(items, selected) if s],
+        [item for item, s in zip(items, selected) if not s],
+    )
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import random
-from collections import OrderedDict, namedtuple
+from array import array
+from collections import Counter, OrderedDict, namedtuple
 
-from random_order.cache import FAILED_FIRST_LAST_FAILED_BUCKET_KEY
+from random_order.bucket_types import HierarchicalKey
+from random_order.cache import FAILED_FIRST_LAST_FAILED_BUCKET_KEY, PINNED_BUCKET_KEYS
+from random_order.order_types import ShuffleOrder
 
 """
 `bucket` is a string representing the bucket in which the item falls based on user's chosen
@@ -19,8 +22,10 @@ disabled sub-bucket of the same larger bucket.
 ItemKey = namedtuple("ItemKey", field_names=("bucket", "disabled", "x"))
 ItemKey.__new__.__defaults__ = (None, None)
 
+_PINNED_BUCKET_PRIORITIES = {key: priority for priority, key in enumerate(PINNED_BUCKET_KEYS)}
 
-def _shuffle_items(items, bucket_key=None, disable=None, seed=None, session=None):
+
+def _shuffle_items(items, bucket_key=None, disable=None, seed=None, session=None, order=None):
     """
     Shuffles a list of `items` in place.
 
@@ -36,75 +41,266 @@ def _shuffle_items(items, bucket_key=None, disable=None, seed=None, session=None
     if this item is ok to be shuffled. It returns a truthy value otherwise and
     the truthy value is used as part of the item's key when determining the bucket
     it belongs to.
+
+    Every bucket gets its own `random.Random` instance derived from `seed` and the bucket key
+    (see `_bucket_rng`), so the order of items within a bucket and the position of a bucket
+    relative to other buckets do not depend on which other buckets exist.
+    The state of the global `random` module, which user code may rely on, is never touched.
+
+    `order` is an instance of one of the classes registered in `random_order.order_types`
+    which ranks buckets and shuffles items within them. Uniform shuffling is used by default.
     """
 
-    if seed is not None:
-        random.seed(seed)
+    if seed is None:
+        seed = random.Random().getrandbits(32)
+
+    if order is None:
+        order = ShuffleOrder()
 
     # If `bucket_key` is falsey, shuffle is global.
     if not bucket_key and not disable:
-        random.shuffle(items)
-        return
-
-    def get_full_bucket_key(item):
-        assert bucket_key or disable
-        if bucket_key and disable:
-            return ItemKey(bucket=bucket_key(item, session), disabled=disable(item, session))
-        elif disable:
-            return ItemKey(disabled=disable(item, session))
+        permutation = array("l", range(len(items)))
+        order.shuffle_bucket(None, memoryview(permutation), items, _bucket_rng(seed, None))
+    else:
+        buckets = bucket_items(items, bucket_key=bucket_key, disable=disable, session=session)
+        permutation = buckets.get_permutation(items, seed, order)
+
+    apply_permutation(items, permutation)
+
+
+class Buckets:
+    """
+    Items grouped in buckets.
+
+    Buckets are numbered in the order in which their first item appears.
+    `keys` is a list of `ItemKey` of each bucket, `indices` is an array of item indices grouped
+    by bucket (in their original order within a bucket) and `offsets` tells where each bucket
+    starts in `indices`. They are built from `ids`, an array of bucket numbers of each item,
+    by a counting sort.
+    """
+
+    def __init__(self, keys, ids):
+        self.keys = keys
+        self.offsets = [0] * (len(keys) + 1)
+        for bucket_id, count in Counter(ids).items():
+            self.offsets[bucket_id + 1] = count
+        for bucket_id in range(len(keys)):
+            self.offsets[bucket_id + 1] += self.offsets[bucket_id]
+
+        self.indices = array("l", [0]) * len(ids)
+        next_positions = self.offsets[:-1]
+        for i, bucket_id in enumerate(ids):
+            self.indices[next_positions[bucket_id]] = i
+            next_positions[bucket_id] += 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def members(self, bucket_id):
+        """
+        Returns a mutable view of indices of items in the bucket.
+        """
+        return memoryview(self.indices)[self.offsets[bucket_id] : self.offsets[bucket_id + 1]]
+
+    def get_permutation(self, items, seed, order):
+        """
+        Shuffles items within buckets, and buckets, and returns an array of item indices
+        in the new order. `items` is the list the buckets were computed for, it is not modified.
+        """
+        bucket_ranks = []
+
+        for bucket_id, full_bucket_key in enumerate(self.keys):
+            members = self.members(bucket_id)
+            rng = _bucket_rng(seed, full_bucket_key)
+            bucket_ranks.append(order.rank_bucket(full_bucket_key, members, items, rng))
+
+            if full_bucket_key.bucket == FAILED_FIRST_LAST_FAILED_BUCKET_KEY:
+                # Do not shuffle the last failed bucket
+                continue
+
+            if not full_bucket_key.disabled:
+                order.shuffle_bucket(full_bucket_key, members, items, rng)
+
+        # Shuffle buckets by sorting them on their ranks, the last failed bucket always goes first
+        # and the bucket of new tests after it (see `PINNED_BUCKET_KEYS`).
+
+        new_bucket_ids = []
+        other_bucket_ids = []
+        for bucket_id, full_bucket_key in enumerate(self.keys):
+            if full_bucket_key.bucket in _PINNED_BUCKET_PRIORITIES:
+                new_bucket_ids.append(bucket_id)
+            else:
+                other_bucket_ids.append(bucket_id)
+        new_bucket_ids.sort(key=lambda b: (_PINNED_BUCKET_PRIORITIES[self.keys[b].bucket], bucket_ranks[b]))
+        if any(isinstance(self.keys[b].bucket, HierarchicalKey) for b in other_bucket_ids):
+            new_bucket_ids.extend(self._sort_levels(other_bucket_ids, 0, bucket_ranks, items, seed, order))
+        else:
+            other_ranks = [bucket_ranks[b] for b in other_bucket_ids]
+            new_bucket_ids.extend(other_bucket_ids[i] for i in order.sort_buckets(other_ranks))
+
+        permutation = array("l")
+        for bucket_id in new_bucket_ids:
+            permutation.extend(self.members(bucket_id))
+        return permutation
+
+    def _sort_levels(self, bucket_ids, depth, bucket_ranks, items, seed, order):
+        """
+        Returns `bucket_ids` of buckets with `HierarchicalKey` keys in the order in which they run.
+
+        Buckets are grouped by their keys up to level `depth`, the groups are ranked and sorted
+        like buckets (with a random generator derived from the seed and the key of the group) and
+        the buckets in each group are sorted in the same way by their keys at the next level.
+        So buckets with the same key at a level are always next to each other.
+
+        Buckets with keys which are not hierarchical (like keys of overrides) are groups of their own
+        among the groups of the first level.
+        """
+        if all(
+            not isinstance(self.keys[b].bucket, HierarchicalKey) or depth == len(self.keys[b].bucket)
+            for b in bucket_ids
+        ):
+            # Buckets with the same key, told apart only by `disabled`.
+            ranks = [bucket_ranks[b] for b in bucket_ids]
+            return [bucket_ids[i] for i in order.sort_buckets(ranks)]
+
+        groups = OrderedDict()
+        for bucket_id in bucket_ids:
+            key = self.keys[bucket_id].bucket
+            if isinstance(key, HierarchicalKey):
+                groups.setdefault((True, key[: depth + 1]), []).append(bucket_id)
+            else:
+                groups.setdefault((False, key), []).append(bucket_id)
+        prefixes = list(groups)
+
+        if len(prefixes) == 1:
+            positions = [0]
         else:
-            return ItemKey(bucket=bucket_key(item, session))
+            ranks = []
+            for prefix in prefixes:
+                indices = array("l")
+                for bucket_id in groups[prefix]:
+                    indices.extend(self.members(bucket_id))
+                key = prefix[1]
+                ranks.append(order.rank_bucket(key, memoryview(indices), items, _bucket_rng(seed, key)))
+            positions = order.sort_buckets(ranks)
+
+        sorted_bucket_ids = []
+        for i in positions:
+            sorted_bucket_ids.extend(
+                self._sort_levels(groups[prefixes[i]], depth + 1, bucket_ranks, items, seed, order)
+            )
+        return sorted_bucket_ids
+
+
+def bucket_items(items, bucket_key=None, disable=None, session=None):
+    """
+    Groups `items` in buckets by `bucket_key` and `disable` (see `_shuffle_items`)
+    and returns a `Buckets` instance.
+
+    For a sequence of items A1, A2, B1, B2, C1, C2,
+    where key(A1) == key(A2) == key(C1) == key(C2),
+    items A1, A2, C1, and C2 will end up in the same bucket.
+    """
+    keys = []
+    ids = array("l")
+    # Bucket numbers by bucket key and then by disabled key.
+    bucket_ids = {}
 
-    # For a sequence of items A1, A2, B1, B2, C1, C2,
-    # where key(A1) == key(A2) == key(C1) == key(C2),
-    # items A1, A2, C1, and C2 will end up in the same bucket.
-    buckets = OrderedDict()
     for item in items:
-        full_bucket_key = get_full_bucket_key(item)
-        if full_bucket_key not in buckets:
-            buckets[full_bucket_key] = []
-        buckets[full_bucket_key].append(item)
+        bucket = bucket_key(item, session) if bucket_key else None
+        disabled = disable(item, session) if disable else None
+        disabled_ids = bucket_ids.get(bucket)
+        if disabled_ids is None:
+            disabled_ids = bucket_ids[bucket] = {}
+        bucket_id = disabled_ids.get(disabled)
+        if bucket_id is None:
+            bucket_id = disabled_ids[disabled] = len(keys)
+            keys.append(ItemKey(bucket=bucket, disabled=disabled))
+        ids.append(bucket_id)
 
-    # Shuffle inside a bucket
+    return Buckets(keys, ids)
 
-    bucket_keys = list(buckets.keys())
 
-    for full_bucket_key in buckets.keys():
-        if full_bucket_key.bucket == FAILED_FIRST_LAST_FAILED_BUCKET_KEY:
-            # Do not shuffle the last failed bucket
-            continue
+def apply_permutation(items, permutation):
+    """
+    Reorders list `items` in place so that the item at position ``permutation[i]`` becomes ``items[i]``.
+    """
+    items[:] = [items[i] for i in permutation]
 
-        if not full_bucket_key.disabled:
-            random.shuffle(buckets[full_bucket_key])
 
-    # Shuffle buckets
+def _bucket_rng(seed, key):
+    """
+    Returns a `random.Random` instance seeded from `seed` and a stable representation of
+    bucket `key`, so that the same bucket gets the same random sequence on every run.
+    """
+    return random.Random("{0}:{1}".format(seed, _stable_key(key)))
 
-    # Only the first bucket can be FAILED_FIRST_LAST_FAILED_BUCKET_KEY
-    if bucket_keys and bucket_keys[0].bucket == FAILED_FIRST_LAST_FAILED_BUCKET_KEY:
-        new_bucket_keys = list(buckets.keys())[1:]
-        random.shuffle(new_bucket_keys)
-        new_bucket_keys.insert(0, bucket_keys[0])
-    else:
-        new_bucket_keys = list(buckets.keys())
-        random.shuffle(new_bucket_keys)
 
-    items[:] = [item for bk in new_bucket_keys for item in buckets[bk]]
-    return
+def _stable_key(key):
+    """
+    Returns a string representation of bucket `key` that does not change between processes.
+
+    Collection nodes (used as keys by `parent` and `grandparent` bucket types) are
+    represented by their node ids.
+    """
+    if isinstance(key, tuple):
+        return "({0})".format(",".join(_stable_key(k) for k in key))
+    nodeid = getattr(key, "nodeid", None)
+    if nodeid is not None:
+        return nodeid
+    return repr(key)
+
 
+def _find_lost_items(original_items, items):
+    """
+    Returns a tuple of two sorted lists: node ids of tests that are in `original_items` but
+    not in `items` (lost), and node ids of tests that appear in `items` more times than in
+    `original_items` (duplicated). Both lists are empty if `items` is a permutation of `original_items`.
+
+    The common case is checked by object identity which doesn't hash any strings,
+    node ids are only compared if that check fails.
+    """
+    if len(items) == len(original_items):
+        original_ids = set(map(id, original_items))
+        if len(original_ids) == len(original_items) and original_ids == set(map(id, items)):
+            return [], []
 
-def _get_set_of_item_ids(items):
-    return set(item.nodeid for item in items)
+    original_counts = Counter(item.nodeid for item in original_items)
+    counts = Counter(item.nodeid for item in items)
+    lost = sorted(original_counts - counts)
+    duplicated = sorted(counts - original_counts)
+    return lost, duplicated
 
 
 def _disable(item, session):
-    if hasattr(item, "get_closest_marker"):
-        marker = item.get_closest_marker("random_order")
+    """
+    Returns the key of the disabled sub-bucket of `item`, or False if `item` can be shuffled.
+
+    Unless the item itself is marked, the answer is the same for all children of the same parent,
+    so it is calculated once per parent node when `session` provides a cache for it.
+    """
+    cache = getattr(session, "random_order_disabled_cache", None)
+    own_markers = getattr(item, "own_markers", None)
+    parent = item.parent
+    if cache is None or own_markers is None or parent is None or any(m.name == "random_order" for m in own_markers):
+        return _get_disabled_key(item, parent)
+
+    try:
+        return cache[parent]
+    except KeyError:
+        disabled = cache[parent] = _get_disabled_key(parent, parent)
+        return disabled
+
+
+def _get_disabled_key(node, parent):
+    if hasattr(node, "get_closest_marker"):
+        marker = node.get_closest_marker("random_order")
     else:
-        marker = item.get_marker("random_order")
+        marker = node.get_marker("random_order")
     if marker:
         is_disabled = marker.kwargs.get("disabled", False)
         if is_disabled:
             # A test item can only be disabled in its parent context -- where it is part of some order.
             # We use parent name as the key so that all children of the same parent get the same disabled key.
-            return item.parent.name
+            return parent.name
     return False
@@ -0,0 +1,125 @@
+"""
+Running the tests in many random orders at once, for ``--random-order-sweep``.
+
+Seeds are derived from ``--random-order-seed`` and, for each seed, the tests are run in a separate
+pytest process with the arguments of the current run, several processes at a time. Failures are
+aggregated per seed and per test, and the orders of the seeds which failed are saved as plans
+so that they can be reproduced with ``--random-order-replay-run`` even if tests change.
+"""
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from random_order.child_runs import ChildRun
+from random_order.replay import PLANS_DIR_NAME, get_plan_path, read_plan, save_plan
+
+# pytest exit codes of runs in which tests were run and passed or failed.
+OK_EXIT_CODES = (0, 1)
+
+
+def derive_seeds(seed, n):
+    """
+    Returns a list of `n` distinct seeds derived from `seed`, in the range of seeds generated by default.
+    """
+    rng = random.Random("{0}:sweep".format(seed))
+    seeds = []
+    seen = set()
+    while len(seeds) < n:
+        derived = str(rng.randint(1, 1000000))
+        if derived not in seen:
+            seen.add(derived)
+            seeds.append(derived)
+    return seeds
+
+
+class Sweep:
+    """
+    Runs the tests once for each of `seeds`.
+
+    `run_seed` is called with a seed and must return a `SeedResult`. It is called from several
+    threads at a time. By default, it runs pytest in a subprocess with the arguments of the current run.
+    """
+
+    def __init__(self, config, seeds, workers=1, run_seed=None):
+        self.config = config
+        self.seeds = list(seeds)
+        self.workers = max(1, workers or 1)
+        self.run_seed = run_seed or self.run_pytest
+
+    def run(self):
+        """
+        Returns a `SweepResult`.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.run_seed, self.seeds))
+
+        if self.config is not None:
+            for result in results:
+                if result.plan is not None and not result.ok:
+                    header, nodeids = result.plan
+                    header = dict((k, v) for k, v in header.items() if k != "run_id")
+                    save_plan(self.config, result.seed, nodeids, last=False, **header)
+
+        return SweepResult(results)
+
+    def run_pytest(self, seed):
+        with ChildRun(self.config, ["--random-order-seed={0}".format(seed)]) as child:
+            returncode = child.run()
+            plan = read_plan(get_plan_path(child.get_plugin_path(PLANS_DIR_NAME), seed))
+            return SeedResult(seed, returncode, sorted(child.get_failed()), plan)
+
+
+class SeedResult:
+    def __init__(self, seed, returncode, failed, plan=None):
+        self.seed = seed
+        self.returncode = returncode
+        self.failed = failed
+        self.plan = plan
+
+    @property
+    def ok(self):
+        return self.returncode in OK_EXIT_CODES and not self.failed
+
+
+class SweepResult:
+    def __init__(self, results):
+        self.results = results
+
+    @property
+    def failed_seeds(self):
+        return [result for result in self.results if not result.ok]
+
+    def get_failed_tests(self):
+        """
+        Returns a list of ``(node id, seeds)`` pairs of tests that failed with some seeds,
+        the tests that failed with most seeds first.
+        """
+        seeds = {}
+        for result in self.results:
+            for nodeid in result.failed:
+                seeds.setdefault(nodeid, []).append(result.seed)
+        return sorted(seeds.items(), key=lambda pair: (-len(pair[1]), pair[0]))
+
+    def format_lines(self):
+        failed_seeds = self.failed_seeds
+        if not failed_seeds:
+            return ["random-order sweep: all {0} seeds passed".format(len(self.results))]
+
+        lines = ["random-order sweep: {0} of {1} seeds failed:".format(len(failed_seeds), len(self.results))]
+        for result in failed_seeds:
+            if result.failed:
+                outcome = "{0} failed".format(len(result.failed))
+            else:
+                outcome = "pytest exited with code {0}".format(result.returncode)
+            if result.plan is not None:
+                outcome += ", replay with --random-order-replay-run={0}".format(result.seed)
+            lines.append("  seed {0}: {1}".format(result.seed, outcome))
+
+        failed_tests = self.get_failed_tests()
+        if failed_tests:
+            lines.append("random-order sweep: tests that failed:")
+            for nodeid, seeds in failed_tests:
+                lines.append(
+                    "  {0}: {1} of {2} seeds ({3})".format(nodeid, len(seeds), len(self.results), ", ".join(seeds))
+                )
+        return lines
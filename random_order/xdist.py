@@ -1,7 +1,63 @@
 import pytest
 
+from random_order.config import Config
+from random_order.replay import load_plan
+
 
 class XdistHooks:
+    def __init__(self):
+        self._plan = None
+        self._previous_order = None
+
     def pytest_configure_node(self, node: pytest.Item) -> None:
         seed = node.config.getoption("random_order_seed")
         node.workerinput["random_order_seed"] = seed
+        node.workerinput["random_order_run_index"] = node.config.getoption("random_order_run_index")
+
+        plan = self.get_plan(node.config)
+        if plan is not None:
+            node.workerinput["random_order_plan"] = plan
+
+        if Config(node.config).mode == "derange":
+            node.workerinput["random_order_previous_order"] = self.get_previous_order(node.config)
+
+    def pytest_xdist_make_scheduler(self, config, log):
+        """
+        With ``--dist loadscope``, sends whole buckets of tests to workers in the shuffled order
+        (see `random_order.xdist_scheduling.BucketScheduling`) instead of grouping tests by module and class.
+        """
+        plugin = Config(config)
+        if config.getvalue("dist") != "loadscope" or plugin.bucket_type == "none":
+            return None
+
+        from random_order.xdist_scheduling import BucketScheduling
+
+        return BucketScheduling(config, log)
+
+    def get_previous_order(self, config):
+        """
+        Returns the list of node ids in the order of the last run, for ``--random-order-mode=derange``,
+        loaded once on the controller before the first worker saves the order of this run.
+        """
+        if self._previous_order is None:
+            plan = load_plan(config)
+            self._previous_order = plan[1] if plan is not None else []
+        return self._previous_order
+
+    def get_plan(self, config):
+        """
+        Returns the plan to replay (see `random_order.replay.load_plan`) as a list of its header and node ids,
+        loaded once on the controller for all workers, or None if not replaying or there is no such plan.
+
+        Workers apply the plan they are sent instead of loading it from their own cache, so they run tests
+        in the same order even if they do not share the controller's cache directory.
+        """
+        replay = Config(config).replay
+        if replay is None:
+            return None
+        if self._plan is None:
+            plan = load_plan(config, None if replay == "last" else replay)
+            if plan is None:
+                return None
+            self._plan = [plan[0], plan[1]]
+        return self._plan
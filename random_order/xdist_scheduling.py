@@ -0,0 +1,109 @@
+"""
+A pytest-xdist scheduler which sends whole buckets of tests to workers in the order the plugin shuffled them,
+used with ``--dist loadscope`` (see `random_order.xdist.XdistHooks.pytest_xdist_make_scheduler`).
+
+The controller does not collect tests, it only receives node ids, in their final order, from the workers.
+Buckets are therefore recognised by node ids: a work unit is a run of consecutive tests with the same
+scope, which `get_nodeid_scope` derives from the node id in the same way as the bucket key of the test.
+"""
+
+import math
+
+from xdist.scheduler import LoadScopeScheduling
+
+from random_order.bucket_types import HIERARCHY_SEPARATOR, get_nodeid_key, nodeid_key_functions
+from random_order.config import Config
+
+
+def get_nodeid_scope(nodeid, bucket_type, cache=None):
+    """
+    Returns a value which is the same for node ids of tests in the same bucket of `bucket_type`:
+    the bucket key (see `random_order.bucket_types.get_nodeid_key`), calculated once per parent
+    node id if `cache` (a dictionary) is passed.
+
+    Tests of ``global`` and ``none`` buckets each get their own scope. Keys of ``fixture`` buckets
+    and of custom bucket types depend on more than the node id, such tests are grouped by module.
+    """
+    levels = bucket_type.split(HIERARCHY_SEPARATOR)
+    if "global" in levels or "none" in levels:
+        return nodeid
+    levels = [level if level in nodeid_key_functions else "module" for level in levels]
+    return get_nodeid_key(nodeid, HIERARCHY_SEPARATOR.join(levels), cache)
+
+
+def get_work_units(nodeids, bucket_type, max_size):
+    """
+    Returns a list of lists of `nodeids` which are runs of consecutive node ids in the same bucket
+    of `bucket_type`. Runs longer than `max_size` are split into runs of about equal length.
+    """
+    units = []
+    last_scope = object()
+    cache = {}
+    for nodeid in nodeids:
+        scope = get_nodeid_scope(nodeid, bucket_type, cache)
+        if scope != last_scope:
+            units.append([])
+            last_scope = scope
+        units[-1].append(nodeid)
+
+    split_units = []
+    for unit in units:
+        parts = int(math.ceil(len(unit) / float(max_size)))
+        size = int(math.ceil(len(unit) / float(parts)))
+        split_units.extend(unit[i : i + size] for i in range(0, len(unit), size))
+    return split_units
+
+
+class BucketScheduling(LoadScopeScheduling):
+    """
+    Load scope scheduling where a scope is a bucket of tests (see `get_work_units`) and
+    work units are sent to workers in the order of the collection.
+
+    Buckets with more tests than a worker's share of all tests are split, so that
+    a single large bucket does not leave other workers idle at the end of the run.
+    """
+
+    def __init__(self, config, log=None):
+        super().__init__(config, log)
+        self.bucket_type = Config(config).bucket_type
+        self.unit_keys = {}
+
+    def _split_scope(self, nodeid):
+        return self.unit_keys[nodeid]
+
+    def schedule(self):
+        assert self.collection_is_completed
+
+        if self.collection is not None:
+            for node in self.nodes:
+                self._reschedule(node)
+            return
+
+        if not self._check_nodes_have_same_collection():
+            self.log("**Different tests collected, aborting run**")
+            return
+
+        self.collection = list(next(iter(self.registered_collections.values())))
+        if not self.collection:
+            return
+
+        max_size = int(math.ceil(len(self.collection) / float(len(self.nodes))))
+        for i, unit in enumerate(get_work_units(self.collection, self.bucket_type, max_size)):
+            key = "{0}:{1}".format(i, unit[0])
+            self.workqueue[key] = dict.fromkeys(unit, False)
+            self.unit_keys.update(dict.fromkeys(unit, key))
+
+        for _ in range(len(self.nodes) - len(self.workqueue)):
+            unused_node, _ = self.assigned_work.popitem()
+            self.log("Shutting down unused node {0}".format(unused_node))
+            unused_node.shutdown()
+
+        for node in self.nodes:
+            self._assign_work_unit(node)
+
+        for node in self.nodes:
+            self._reschedule(node)
+
+        if not self.workqueue:
+            for node in self.nodes:
+                node.shutdown()
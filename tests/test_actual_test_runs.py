@@ -158,6 +158,7 @@ def check_call_sequence(seq, bucket="module"):
         ("none", 1, 1),
         ("parent", 1, 5),
         ("grandparent", 1, 5),
+        ("fixture", 2, 5),
     ],
 )
 def test_it_works_with_actual_tests(tmp_tree_of_tests, get_test_calls, bucket, min_sequences, max_sequences):
@@ -232,6 +233,8 @@ def test_generated_seed_is_reported_and_run_can_be_reproduced(testdir, twenty_te
         "class",
         "parent",
         "grandparent",
+        "fixture",
+        "package/module/class",
         "none",
     ],
 )
@@ -0,0 +1,27 @@
+import os
+import runpy
+
+import pytest
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "collection.py")
+
+
+@pytest.mark.filterwarnings("error")
+def test_collection_benchmark_runs(tmpdir):
+    benchmark = runpy.run_path(BENCHMARK)
+    json_path = str(tmpdir.join("bench.json"))
+
+    results = benchmark["main"](["--sizes", "50", "--repeat", "1", "--json", json_path])
+
+    phases = {r.phase for r in results}
+    assert phases == {"keys", "disable", "shuffle", "integrity", "hook"}
+    assert {r.bucket_type for r in results} == {
+        "global",
+        "package",
+        "module",
+        "class",
+        "parent",
+        "grandparent",
+        "fixture",
+    }
+    assert os.path.exists(json_path)
@@ -0,0 +1,88 @@
+import collections
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from random_order.bisection import Bisection, find_polluters
+
+Item = collections.namedtuple("Item", field_names=("nodeid",))
+
+
+def make_fails(polluters):
+    def fails(nodeids):
+        return polluters.issubset(nodeids)
+
+    return fails
+
+
+@pytest.mark.parametrize("polluters", [{"t7"}, {"t3", "t15"}, {"t0", "t1", "t19"}])
+def test_find_polluters_finds_minimal_set(polluters):
+    prefix = ["t{0}".format(i) for i in range(20)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert set(find_polluters(prefix, make_fails(polluters), executor)) == polluters
+
+
+def test_find_polluters_keeps_order_of_prefix():
+    prefix = ["t{0}".format(i) for i in range(20)]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert find_polluters(prefix, make_fails({"t12", "t4"}), executor) == ["t4", "t12"]
+
+
+@pytest.mark.parametrize(
+    "fails, outcome",
+    [
+        (lambda nodeids: True, "alone"),
+        (lambda nodeids: False, "passed"),
+        (lambda nodeids: "a" in nodeids, "polluted"),
+    ],
+)
+def test_bisection_outcomes(fails, outcome):
+    items = [Item(nodeid) for nodeid in ("a", "b", "c", "target", "d")]
+    result = Bisection(None, items, "target", workers=2, fails=fails).run()
+    assert result.outcome == outcome
+    assert result.polluters == (["a"] if outcome == "polluted" else [])
+    assert result.runs >= 2
+
+
+def test_bisect_finds_polluter_in_separate_runs(testdir):
+    testdir.makepyfile(state="polluted = []\n")
+    testdir.makepyfile(
+        test_a=textwrap.dedent("""
+        import state
+
+        def test_clean_1(): pass
+        def test_polluter(): state.polluted.append(True)
+        def test_clean_2(): pass
+    """),
+        test_b=textwrap.dedent("""
+        import state
+
+        def test_clean_3(): pass
+        def test_clean_4(): pass
+        def test_victim(): assert not state.polluted
+        def test_clean_5(): pass
+    """),
+    )
+
+    result = testdir.runpytest(
+        "--random-order-bucket=none",
+        "--random-order-bisect=test_b.py::test_victim",
+        "--random-order-workers=4",
+    )
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(
+        [
+            "random-order bisect: test_b.py::test_victim fails when run after these tests (* pytest runs):",
+            "  test_a.py::test_polluter",
+        ]
+    )
+    result.stdout.no_fnmatch_line("*test_clean*")
+    result.assert_outcomes()
+
+
+def test_bisect_of_test_that_was_not_collected_is_an_error(testdir):
+    testdir.makepyfile(test_a="def test_a(): pass\n")
+    result = testdir.runpytest("--random-order-bisect=test_a.py::test_b")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*test test_a.py::test_b was not collected*"])
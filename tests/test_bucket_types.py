@@ -0,0 +1,252 @@
+import argparse
+import collections
+
+import pytest
+
+from random_order import bucket_types
+from random_order.bucket_types import (
+    HierarchicalKey,
+    bucket_type_keys,
+    bucket_type_option,
+    compile_bucket_key,
+    get_bucket_key,
+    get_nodeid_key,
+)
+from random_order.shuffler import _disable, _shuffle_items
+
+Marker = collections.namedtuple("Marker", field_names=("name", "kwargs"))
+
+
+class Node:
+    def __init__(self, name, parent=None, markers=()):
+        self.name = name
+        self.parent = parent
+        self.own_markers = list(markers)
+        self.marker_lookups = 0
+        self.nodeid_lookups = 0
+
+    @property
+    def nodeid(self):
+        self.nodeid_lookups += 1
+        return self.name
+
+    def get_closest_marker(self, name):
+        self.marker_lookups += 1
+        node = self
+        while node is not None:
+            for marker in node.own_markers:
+                if marker.name == name:
+                    return marker
+            node = node.parent
+
+
+class Item(Node):
+    nodeid = None
+
+    def __init__(self, name, parent=None, markers=()):
+        super().__init__(name, parent, markers)
+        self.nodeid = "{0}::{1}".format(parent.name, name)
+
+
+class Session:
+    def __init__(self):
+        self.random_order_disabled_cache = {}
+
+
+def make_items():
+    disabled = Marker("random_order", {"disabled": True})
+    modules = [Node("test_a.py"), Node("test_b.py", markers=[disabled])]
+    return [Item("test_{0}".format(i), parent=module) for module in modules for i in range(5)]
+
+
+def test_bucket_key_is_calculated_once_per_parent():
+    items = make_items()
+    bucket_key = compile_bucket_key(bucket_type_keys["module"])
+
+    keys = [bucket_key(item, None) for item in items]
+
+    assert keys == ["test_a.py"] * 5 + ["test_b.py"] * 5
+    assert [module.nodeid_lookups for module in (items[0].parent, items[-1].parent)] == [1, 1]
+
+
+def test_disabled_key_is_calculated_once_per_parent():
+    items = make_items()
+    session = Session()
+
+    disabled = [_disable(item, session) for item in items]
+
+    assert disabled == [False] * 5 + ["test_b.py"] * 5
+    assert [item.marker_lookups for item in items] == [0] * 10
+    assert [module.marker_lookups for module in (items[0].parent, items[-1].parent)] == [1, 1]
+
+
+def test_marker_on_item_is_not_hidden_by_parent_cache():
+    items = make_items()
+    items[1].own_markers.append(Marker("random_order", {"disabled": True}))
+    session = Session()
+
+    disabled = [_disable(item, session) for item in items]
+
+    assert disabled == [False, "test_a.py", False, False, False] + ["test_b.py"] * 5
+
+
+def test_compiled_bucket_key_calculates_key_once_per_parent_and_applies_overrides():
+    items = make_items()
+
+    bucket_key = compile_bucket_key(
+        bucket_type_keys["module"],
+        overrides={"test_a.py::test_1": "special", "test_b.py::test_2": "special"},
+    )
+
+    keys = [bucket_key(item, None) for item in items]
+
+    assert keys == ["test_a.py", "special", "test_a.py", "test_a.py", "test_a.py"] + [
+        "test_b.py",
+        "test_b.py",
+        "special",
+        "test_b.py",
+        "test_b.py",
+    ]
+    assert [module.nodeid_lookups for module in (items[0].parent, items[-1].parent)] == [1, 1]
+
+
+def test_compiled_bucket_key_applies_legacy_handlers():
+    items = make_items()
+
+    bucket_key = compile_bucket_key(bucket_type_keys["module"], handlers=[lambda item, key: key.upper()])
+
+    assert {bucket_key(item, None) for item in items} == {"TEST_A.PY", "TEST_B.PY"}
+
+
+class HierarchyItem:
+    def __init__(self, package, module, cls, name):
+        self.nodeid = "::".join(part for part in ("{0}/{1}.py".format(package, module), cls, name) if part)
+        self.parent = None
+        self.path = (package, module, cls)
+
+
+def make_hierarchy_items():
+    return [
+        HierarchyItem(package, module, cls, "test_{0}".format(i))
+        for package in ("p1", "p2", "p3")
+        for module in ("m1", "m2", "m3")
+        for cls in (None, "C1", "C2")
+        for i in range(3)
+    ]
+
+
+def get_runs(values):
+    return [value for i, value in enumerate(values) if i == 0 or value != values[i - 1]]
+
+
+def test_hierarchical_bucket_type_shuffles_each_level_within_the_level_before():
+    items = make_hierarchy_items()
+    bucket_key = compile_bucket_key(get_bucket_key("package/module/class"))
+
+    package_orders = set()
+    module_orders = set()
+    for seed in range(10):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=bucket_key, seed=seed)
+        assert sorted(shuffled, key=id) == sorted(items, key=id)
+
+        for depth in (1, 2, 3):
+            runs = get_runs([item.path[:depth] for item in shuffled])
+            assert len(runs) == len(set(runs))
+        package_orders.add(tuple(get_runs([item.path[0] for item in shuffled])))
+        module_orders.add(tuple(get_runs([item.path[1] for item in shuffled if item.path[0] == "p1"])))
+        assert shuffled != items
+
+    assert len(package_orders) > 1
+    assert len(module_orders) > 1
+
+
+def test_hierarchical_bucket_type_keeps_levels_together_around_overridden_tests():
+    items = make_hierarchy_items()
+    slow = items[40]
+    bucket_key = compile_bucket_key(get_bucket_key("package/module/class"), overrides={slow.nodeid: "slow"})
+
+    positions = set()
+    for seed in range(10):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=bucket_key, seed=seed)
+        positions.add(shuffled.index(slow))
+
+        for depth in (1, 2, 3):
+            runs = get_runs([item.path[:depth] for item in shuffled if item is not slow])
+            assert len(runs) == len(set(runs))
+        # The overridden test runs between packages.
+        package_runs = get_runs([item.path[0] if item is not slow else "slow" for item in shuffled])
+        assert len(package_runs) == len(set(package_runs))
+
+    assert len(positions) > 1
+
+
+@pytest.mark.parametrize(
+    "nodeid, keys",
+    [
+        ("tests/test_a.py::test_x", ("tests", "tests/test_a.py", "tests/test_a.py", "tests")),
+        (
+            "tests/test_a.py::TestA::test_x[a::b]",
+            ("tests", "tests/test_a.py", "tests/test_a.py::TestA", "tests/test_a.py"),
+        ),
+        (
+            "tests/test_a.py::TestA::TestB::test_x",
+            ("tests", "tests/test_a.py", "tests/test_a.py::TestA::TestB", "tests/test_a.py::TestA"),
+        ),
+        ("test_a.py::test_x[1]", ("", "test_a.py", "test_a.py", "")),
+        ("pkg/mod.py::pkg.mod.func", ("pkg", "pkg/mod.py", "pkg/mod.py", "pkg")),
+        ("docs/index.rst::index.rst", ("docs", "docs/index.rst", "docs/index.rst", "docs")),
+        (
+            "specs/spec.yaml::suite[x]::case",
+            ("specs", "specs/spec.yaml", "specs/spec.yaml::suite[x]", "specs/spec.yaml"),
+        ),
+        (
+            "specs/spec.yaml::suite[x]::case[y::z]",
+            ("specs", "specs/spec.yaml", "specs/spec.yaml::suite[x]", "specs/spec.yaml"),
+        ),
+    ],
+)
+def test_bucket_keys_are_calculated_from_node_ids(nodeid, keys):
+    item = HierarchyItem("p", "m", None, "test")
+    item.nodeid = nodeid
+    for bucket_type, key in zip(("package", "module", "class", "grandparent"), keys):
+        assert bucket_type_keys[bucket_type](item, None) == key
+        assert get_nodeid_key(nodeid, bucket_type) == key
+    assert get_nodeid_key(nodeid, "package/module") == HierarchicalKey(keys[:2])
+
+
+def test_bucket_keys_of_items_are_calculated_from_node_ids_of_parents():
+    # The parameter of @pytest.mark.parametrize("x", ["]::["]) looks like the name of a node.
+    item = Item("t[]::[]", parent=Node("tests/a.py"))
+    for bucket_type, key in zip(("package", "module", "class"), ("tests", "tests/a.py", "tests/a.py")):
+        assert bucket_type_keys[bucket_type](item, None) == key
+
+
+def test_hierarchical_bucket_type_option_is_validated():
+    assert bucket_type_option("package/module/class") == "package/module/class"
+    assert bucket_type_option("default:module") == "default:module"
+    for value in ("module/none", "global/module", "package/nonsense", "nonsense"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            bucket_type_option(value)
+
+
+def test_hierarchical_bucket_type_in_test_run(testdir, get_test_calls):
+    testdir.makepyfile(
+        **{
+            "test_{0}".format(module): "".join(
+                "class Test{0}:\n".format(cls) + "".join("    def test_{0}(self): pass\n".format(i) for i in range(3))
+                for cls in ("A", "B", "C")
+            )
+            for module in ("x", "y", "z")
+        }
+    )
+    result = testdir.runpytest("--random-order-bucket=module/class")
+    result.assert_outcomes(passed=27)
+    result.stdout.fnmatch_lines(["Using --random-order-bucket=module/class"])
+    classes = get_runs([c.cls for c in get_test_calls(result)])
+    assert len(classes) == 9
+
+    result = testdir.runpytest("--random-order-bucket=module/nonsense")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*invalid choice: 'module/nonsense'*"])
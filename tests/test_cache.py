@@ -0,0 +1,81 @@
+import collections
+import textwrap
+
+import pytest
+
+from random_order.cache import NodeIdIndex
+
+Node = collections.namedtuple("Node", field_names=("nodeid", "parent"))
+
+
+def test_node_id_index_contains_nodes_and_their_children():
+    module = Node("test_a.py", None)
+    cls = Node("test_a.py::TestA", module)
+    nested = Node("test_a.py::TestA::TestB", cls)
+    other_module = Node("test_b.py", None)
+
+    index = NodeIdIndex(["test_a.py::TestA::TestB", "test_b.py::test_x[a::b]"])
+    assert Node("test_a.py::TestA::TestB::test_1[x-y]", nested) in index
+    assert Node("test_a.py::TestA::test_2", cls) not in index
+    assert Node("test_b.py::test_x[a::b]", other_module) in index
+    assert Node("test_b.py::test_x[a::c]", other_module) not in index
+    assert Node("test_a.py::TestA::test_3", cls) not in index
+
+
+@pytest.fixture
+def tests_with_any_node_ids(testdir):
+    testdir.makepyfile(
+        test_a=textwrap.dedent("""
+        import pytest
+
+        class TestOuter:
+            class TestInner:
+                def test_nested(self):
+                    assert False
+
+                def test_nested_ok(self):
+                    pass
+
+        @pytest.mark.parametrize("x", ["a::b", "c::d"])
+        def test_param(x):
+            assert x != "a::b"
+    """),
+        test_b="".join("def test_b{0}(): pass\n".format(i) for i in range(10)),
+    )
+    return testdir
+
+
+def test_failed_first_with_nested_classes_and_parametrized_ids(tests_with_any_node_ids, get_test_calls):
+    tests_with_any_node_ids.runpytest("--random-order").assert_outcomes(passed=12, failed=2)
+
+    for seed in range(3):
+        result = tests_with_any_node_ids.runpytest(
+            "--random-order-bucket=global", "--random-order-seed={0}".format(seed), "--failed-first"
+        )
+        result.assert_outcomes(passed=12, failed=2)
+        assert {c.name for c in get_test_calls(result)[:2]} == {"test_nested", "test_param[a::b]"}
+
+
+def test_new_first_puts_new_tests_after_failed_ones(tests_with_any_node_ids, get_test_calls):
+    tests_with_any_node_ids.runpytest("--random-order").assert_outcomes(passed=12, failed=2)
+    tests_with_any_node_ids.makepyfile(test_c="def test_c1(): pass\ndef test_c2(): pass\n")
+    with open("test_b.py", "a") as f:
+        f.write("\ndef test_b_new(): pass\n")
+
+    # Tests are only new in the first run after they were added.
+    for new_tests in ({"test_c1", "test_c2", "test_b_new"}, set()):
+        result = tests_with_any_node_ids.runpytest("--random-order-bucket=module", "--failed-first", "--new-first")
+        result.assert_outcomes(passed=15, failed=2)
+        names = [c.name for c in get_test_calls(result)]
+        assert set(names[:2]) == {"test_nested", "test_param[a::b]"}
+        assert set(names[2 : 2 + len(new_tests)]) == new_tests
+
+
+def test_new_first_does_not_undo_shuffling(tests_with_any_node_ids, get_test_calls):
+    tests_with_any_node_ids.makepyfile(test_c="def test_c1(): pass\ndef test_c2(): pass\n")
+    tests_with_any_node_ids.runpytest("--random-order")
+
+    for seed in range(5):
+        args = ("--random-order-bucket=global", "--random-order-seed={0}".format(seed))
+        result = tests_with_any_node_ids.runpytest(*args)
+        assert get_test_calls(tests_with_any_node_ids.runpytest("--new-first", *args)) == get_test_calls(result)
@@ -5,8 +5,9 @@ def test_help_message(testdir):
     result.stdout.fnmatch_lines(
         [
             "pytest-random-order options:",
-            "*--random-order-bucket={global,package,module,class,parent,grandparent,none}*",
+            "*--random-order-bucket={global,package,module,class,parent,grandparent,fixture,none}*",
             "*--random-order-seed=*",
+            "*--random-order-mode={shuffle,balanced,weighted,guided,derange,covering}*",
         ]
     )
 
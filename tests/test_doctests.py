@@ -50,6 +50,7 @@ def tmp_tree_of_tests(testdir):
         "class",
         "parent",
         "grandparent",
+        "fixture",
         "none",
     ],
 )
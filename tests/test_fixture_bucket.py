@@ -0,0 +1,176 @@
+import textwrap
+
+import pytest
+
+
+@pytest.fixture
+def tmp_tree_of_tests(testdir):
+    """
+    Creates two modules, each with a module-scoped fixture used by some of its tests.
+    Every setup of the fixture is recorded in setups.txt.
+    """
+
+    testdir.makeconftest(
+        textwrap.dedent("""
+        import pytest
+
+        @pytest.fixture(scope="module")
+        def db(request):
+            with open(str(request.config.rootpath / "setups.txt"), "a") as f:
+                f.write(request.module.__name__ + "\\n")
+            return object()
+    """)
+    )
+
+    for module in ("test_a", "test_b"):
+        code = []
+        for i in range(10):
+            code.append("def test_{0}_db{1}(db): assert True\n".format(module, i))
+            code.append("def test_{0}_plain{1}(): assert True\n".format(module, i))
+        testdir.makepyfile(**{module: "".join(code)})
+
+    return testdir
+
+
+def test_fixture_bucket_sets_up_module_fixture_once_per_module(tmp_tree_of_tests, get_test_calls):
+    sequences = set()
+
+    for seed in range(5):
+        setups = tmp_tree_of_tests.tmpdir.join("setups.txt")
+        if setups.exists():
+            setups.remove()
+
+        result = tmp_tree_of_tests.runpytest("--random-order-bucket=fixture", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=40)
+        result.stdout.fnmatch_lines(
+            ["random-order: 2 higher-scoped fixture setups, 2 with --random-order-bucket=module"]
+        )
+
+        assert sorted(setups.read().splitlines()) == ["test_a", "test_b"]
+        sequences.add(tuple(c.name for c in get_test_calls(result)))
+
+    assert len(sequences) > 1
+
+
+def test_fixture_bucket_mixes_tests_without_higher_scoped_fixtures_across_modules(tmp_tree_of_tests, get_test_calls):
+    for seed in range(5):
+        result = tmp_tree_of_tests.runpytest("--random-order-bucket=fixture", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=40)
+        modules = [c.module for c in get_test_calls(result) if "_plain" in c.name]
+        num_module_switches = sum(1 for prev, this in zip(modules, modules[1:]) if prev != this)
+        if num_module_switches > 1:
+            return
+
+    pytest.fail("Tests without higher-scoped fixtures are never mixed across modules")
+
+
+def test_fixture_bucket_keeps_tests_with_overlapping_fixtures_together(testdir):
+    testdir.makeconftest(
+        textwrap.dedent("""
+        import pytest
+
+        def record(request, name):
+            with open(str(request.config.rootpath / "setups.txt"), "a") as f:
+                f.write(name + " " + request.module.__name__ + "\\n")
+
+        @pytest.fixture(scope="module")
+        def db(request):
+            record(request, "db")
+
+        @pytest.fixture(scope="module")
+        def cache(request):
+            record(request, "cache")
+    """)
+    )
+    for module in ("test_a", "test_b", "test_c"):
+        code = []
+        for i in range(4):
+            code.append("def test_db{0}(db): pass\n".format(i))
+            code.append("def test_db_cache{0}(db, cache): pass\n".format(i))
+            code.append("def test_cache{0}(cache): pass\n".format(i))
+            code.append("def test_plain{0}(): pass\n".format(i))
+        testdir.makepyfile(**{module: "".join(code)})
+
+    setups = testdir.tmpdir.join("setups.txt")
+    for seed in range(5):
+        if setups.exists():
+            setups.remove()
+        result = testdir.runpytest("--random-order-bucket=fixture", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=48)
+        result.stdout.fnmatch_lines(
+            ["random-order: 6 higher-scoped fixture setups, 6 with --random-order-bucket=module"]
+        )
+        assert sorted(setups.read().splitlines()) == sorted(
+            "{0} {1}".format(name, module) for name in ("db", "cache") for module in ("test_a", "test_b", "test_c")
+        )
+
+
+RECORDING_CONFTEST = textwrap.dedent("""
+    import pytest
+
+    def record(request, name):
+        with open(str(request.config.rootpath / "setups.txt"), "a") as f:
+            f.write(name + "\\n")
+""")
+
+
+def run_fixture_bucket(testdir, passed):
+    setups = testdir.tmpdir.join("setups.txt")
+    for seed in range(5):
+        if setups.exists():
+            setups.remove()
+        result = testdir.runpytest("--random-order-bucket=fixture", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=passed)
+        yield result, sorted(setups.read().splitlines())
+
+
+def test_fixture_bucket_keeps_tests_of_class_fixture_together_within_module_fixture(testdir):
+    testdir.makeconftest(
+        RECORDING_CONFTEST
+        + textwrap.dedent("""
+        @pytest.fixture(scope="module")
+        def m(request):
+            record(request, "m " + request.module.__name__)
+
+        @pytest.fixture(scope="class")
+        def c(request):
+            record(request, "c " + request.cls.__name__)
+    """)
+    )
+    code = ["import pytest\n", "pytestmark = pytest.mark.usefixtures('m')\n"]
+    code.extend("def test_f{0}(): pass\n".format(i) for i in range(6))
+    code.append("@pytest.mark.usefixtures('c')\nclass TestA:\n")
+    code.extend("    def test_a{0}(self): pass\n".format(i) for i in range(6))
+    testdir.makepyfile(test_a="".join(code), test_b="".join(code))
+
+    for result, setups in run_fixture_bucket(testdir, passed=24):
+        result.stdout.fnmatch_lines(
+            ["random-order: 4 higher-scoped fixture setups, * with --random-order-bucket=module"]
+        )
+        assert setups == ["c TestA", "c TestA", "m test_a", "m test_b"]
+
+
+def test_fixture_bucket_keeps_modules_of_package_fixture_together(testdir, get_test_calls):
+    testdir.makeconftest(
+        RECORDING_CONFTEST
+        + textwrap.dedent("""
+        @pytest.fixture(scope="package")
+        def p(request):
+            record(request, "p")
+
+        @pytest.fixture(scope="module")
+        def m(request):
+            record(request, "m " + request.module.__name__)
+    """)
+    )
+    package = testdir.mkpydir("pkg")
+    for module in ("test_x", "test_y"):
+        code = "".join("def test_{0}{1}(p, m): pass\n".format(module, i) for i in range(4))
+        package.join("{0}.py".format(module)).write(code)
+    testdir.makepyfile(test_plain="".join("def test_plain{0}(): pass\n".format(i) for i in range(8)))
+
+    for result, setups in run_fixture_bucket(testdir, passed=16):
+        result.stdout.fnmatch_lines(
+            ["random-order: 3 higher-scoped fixture setups, * with --random-order-bucket=module"]
+        )
+        assert setups == ["m pkg.test_x", "m pkg.test_y", "p"]
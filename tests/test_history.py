@@ -0,0 +1,143 @@
+import sqlite3
+import textwrap
+
+from random_order import history
+from random_order.__main__ import main
+
+
+def test_runs_are_added_and_old_ones_removed(tmpdir, monkeypatch):
+    monkeypatch.setattr(history, "MAX_RUNS", 3)
+    connection = history.connect(str(tmpdir.join("history.sqlite3")))
+    for i in range(5):
+        outcome = "failed" if i % 2 else "passed"
+        results = {"test_a": ("passed", 0.1), "test_b": (outcome, 0.2)}
+        history.add_run(connection, results, ["test_b", "test_a"][:: 1 - i % 2 * 2], run_id=str(i), seed=str(i))
+
+    assert [run[0] for run in history.get_runs(connection)] == ["4", "3", "2"]
+    assert history.get_flaky_tests(connection) == [("test_b", 3, 1, ["3"])]
+    assert [
+        (run_id, position, outcome)
+        for run_id, _, _, _, position, outcome, _ in history.get_test_history(connection, "test_b")
+    ] == [("4", 0, "passed"), ("3", 1, "failed"), ("2", 0, "passed")]
+    assert connection.execute("SELECT COUNT(*) FROM results").fetchone() == (6,)
+
+
+def test_old_runs_are_removed_beyond_the_number_of_results(tmpdir, monkeypatch):
+    monkeypatch.setattr(history, "MAX_RESULTS", 5)
+    connection = history.connect(str(tmpdir.join("history.sqlite3")))
+    for i, nodeids in enumerate([["test_a", "test_b"], ["test_b", "test_c"], ["test_c", "test_d"]]):
+        history.add_run(connection, dict.fromkeys(nodeids, ("passed", 0.1)), nodeids, run_id=str(i))
+
+    assert [run[0] for run in history.get_runs(connection)] == ["2", "1"]
+    assert connection.execute("SELECT COUNT(*) FROM results").fetchone() == (4,)
+    # Node ids no longer referred to are kept until there are twice as many as tests in the last run.
+    assert connection.execute("SELECT COUNT(*) FROM tests").fetchone() == (4,)
+    for i, nodeids in enumerate([["test_e"], ["test_f", "test_g"]], 3):
+        history.add_run(connection, dict.fromkeys(nodeids, ("passed", 0.1)), nodeids, run_id=str(i))
+    assert [run[0] for run in history.get_runs(connection)] == ["4", "3", "2"]
+    assert sorted(nodeid for (nodeid,) in connection.execute("SELECT nodeid FROM tests")) == [
+        "test_c",
+        "test_d",
+        "test_e",
+        "test_f",
+        "test_g",
+    ]
+
+    # The last run is kept however many results it has.
+    nodeids = ["test_{0}".format(i) for i in range(10)]
+    history.add_run(connection, dict.fromkeys(nodeids, ("passed", 0.1)), nodeids, run_id="5")
+    assert [run[0] for run in history.get_runs(connection)] == ["5"]
+    assert connection.execute("SELECT COUNT(*) FROM results").fetchone() == (10,)
+
+
+def test_database_of_another_schema_version_is_recreated(tmpdir):
+    path = str(tmpdir.join("history.sqlite3"))
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE results (run INTEGER, nodeid TEXT)")
+    connection = history.connect(path)
+    history.add_run(connection, {"test_a": ("passed", 0.1)}, ["test_a"], run_id="1")
+    assert [run[0] for run in history.get_runs(connection)] == ["1"]
+
+
+def test_runs_are_recorded_only_when_asked_to(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests)
+    db = testdir.tmpdir.join(".pytest_cache/d/random_order/history.sqlite3")
+
+    testdir.runpytest("--random-order").assert_outcomes(passed=20)
+    assert not db.exists()
+
+    testdir.runpytest("--random-order", "--random-order-history").assert_outcomes(passed=20)
+    assert db.exists()
+
+
+def test_history_of_runs_finds_tests_failing_in_some_orders(testdir, capsys):
+    testdir.makepyfile(
+        test_a=textwrap.dedent("""
+        import pytest
+
+        state = []
+
+        def test_pollute():
+            state.append(1)
+
+        def test_victim():
+            assert not state
+
+        @pytest.mark.skip
+        def test_skipped():
+            pass
+        """)
+    )
+    for seed in range(6):
+        testdir.runpytest("--random-order-seed={0}".format(seed), "--random-order-history")
+
+    db = testdir.tmpdir.join(".pytest_cache/d/random_order/history.sqlite3")
+    connection = sqlite3.connect(str(db))
+    outcomes = dict(
+        connection.execute(
+            "SELECT runs.run_id, outcome FROM results JOIN runs ON runs.id = results.run "
+            "JOIN tests ON tests.id = results.test WHERE nodeid LIKE '%victim'"
+        )
+    )
+    assert set(outcomes.values()) == {"passed", "failed"}
+    assert set(
+        connection.execute(
+            "SELECT outcome FROM results JOIN tests ON tests.id = results.test WHERE nodeid LIKE '%skipped'"
+        )
+    ) == {("skipped",)}
+
+    capsys.readouterr()
+    assert main(["flaky"]) == 0
+    failed = sorted(run_id for run_id, outcome in outcomes.items() if outcome == "failed")
+    out = capsys.readouterr().out.splitlines()
+    assert out[
+        0
+    ] == "test_a.py::test_victim: failed in {0} of 6 runs, replay with --random-order-replay-run={1}".format(
+        len(failed), failed[-1]
+    )
+
+    # Plans of old runs are removed, those runs are not suggested for replay.
+    testdir.tmpdir.join(".pytest_cache/d/random_order/plans/{0}.txt.gz".format(failed[-1])).remove()
+    assert main(["flaky"]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "test_a.py::test_victim: failed in {0} of 6 runs{1}".format(
+        len(failed), ", replay with --random-order-replay-run={0}".format(failed[-2]) if len(failed) > 1 else ""
+    )
+    assert out[1] == "  also failed in runs {0}".format(", ".join([failed[-1]] + failed[-3::-1]))
+
+    assert main(["test", "test_a.py::test_victim"]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert len(out) == 6
+    assert out[0].startswith("5: {0} at position".format(outcomes["5"]))
+
+
+def test_predecessors_of_tests_are_collected_from_the_last_runs(tmpdir):
+    connection = history.connect(str(tmpdir.join("history.sqlite3")))
+    for i, order in enumerate([["test_d", "test_a"], ["test_a", "test_b", "test_c"], ["test_c", "test_b", "test_a"]]):
+        history.add_run(connection, dict.fromkeys(order, ("passed", 0.1)), order, run_id=str(i))
+
+    assert history.get_predecessors(connection, ["test_a", "test_b", "test_e"], 2) == {
+        "test_a": {"test_b", "test_c"},
+        "test_b": {"test_a", "test_c"},
+        "test_e": set(),
+    }
@@ -0,0 +1,21 @@
+import textwrap
+
+
+def test_bucket_key_overrides_hook_moves_tests_to_one_bucket(testdir, get_test_calls):
+    testdir.makeconftest(
+        textwrap.dedent("""
+        def pytest_random_order_bucket_key_overrides(session, config, items):
+            return {item.nodeid: "slow" for item in items if item.name.endswith("_slow")}
+    """)
+    )
+    for module in ("test_a", "test_b", "test_c"):
+        testdir.makepyfile(
+            **{module: "".join("def test_{0}_{1}(): pass\n".format(module, name) for name in ("x", "y", "z", "slow"))}
+        )
+
+    for seed in range(5):
+        result = testdir.runpytest("--random-order-bucket=module", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=12)
+        names = [c.name for c in get_test_calls(result)]
+        slow = [i for i, name in enumerate(names) if name.endswith("_slow")]
+        assert slow == list(range(slow[0], slow[0] + 3))
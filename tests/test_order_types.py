@@ -0,0 +1,298 @@
+import collections
+import json
+import random
+import textwrap
+
+import pytest
+
+from random_order import history
+from random_order.order_types import (
+    BalancedOrder,
+    CoveringOrder,
+    DerangeOrder,
+    GuidedOrder,
+    WeightedOrder,
+    get_covering_order,
+    get_covering_period,
+    get_derangement,
+)
+from random_order.shuffler import _shuffle_items
+
+Item = collections.namedtuple("Item", field_names=("nodeid", "module"))
+
+
+def module_key(item, session):
+    return item.module
+
+
+def test_balanced_order_runs_longest_buckets_first():
+    items = [Item("{0}::test_{1}".format(module, i), module) for module in ("a", "b", "c", "d") for i in range(5)]
+
+    order = BalancedOrder()
+    order.durations = {item.nodeid: {"a": 0.1, "b": 4.0, "c": 1.0, "d": 0.1}[item.module] for item in items}
+
+    for seed in range(10):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=seed, order=order)
+        modules = [item.module for item in shuffled]
+        assert modules[:10] == ["b"] * 5 + ["c"] * 5
+        assert set(modules[10:]) == {"a", "d"}
+
+
+def test_balanced_order_shuffles_buckets_of_similar_duration():
+    items = [Item("{0}::test_{1}".format(module, i), module) for module in "abcdefgh" for i in range(2)]
+
+    order = BalancedOrder()
+    order.durations = {item.nodeid: 1.0 for item in items}
+
+    bucket_orders = set()
+    for seed in range(10):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=seed, order=order)
+        bucket_orders.add(tuple(item.module for item in shuffled[::2]))
+
+    assert len(bucket_orders) > 1
+
+
+@pytest.fixture
+def slow_and_fast_modules(testdir):
+    testdir.makepyfile(
+        test_slow=textwrap.dedent("""
+        import time
+
+        def test_slow1():
+            time.sleep(0.2)
+
+        def test_slow2():
+            time.sleep(0.2)
+        """),
+        **{
+            "test_fast{0}".format(i): "def test_fast{0}_1(): pass\ndef test_fast{0}_2(): pass\n".format(i)
+            for i in range(4)
+        },
+    )
+    return testdir
+
+
+def test_balanced_mode_uses_durations_recorded_in_previous_run(slow_and_fast_modules, get_test_calls):
+    result = slow_and_fast_modules.runpytest("--random-order")
+    result.assert_outcomes(passed=10)
+
+    durations = json.loads(slow_and_fast_modules.tmpdir.join(".pytest_cache/v/random_order/durations").read())
+    assert durations["test_slow.py::test_slow1"] >= 0.2
+
+    for seed in range(3):
+        result = slow_and_fast_modules.runpytest(
+            "--random-order-mode=balanced", "--random-order-seed={0}".format(seed), "-v"
+        )
+        result.assert_outcomes(passed=10)
+        result.stdout.fnmatch_lines(["Using --random-order-mode=balanced"])
+        calls = get_test_calls(result)
+        assert {c.module for c in calls[:2]} == {"test_slow"}
+
+
+def test_weighted_order_runs_likely_failing_and_fast_tests_earlier():
+    items = [Item("{0}::test_{1}".format(module, i), module) for module in ("a", "b", "c", "d") for i in range(5)]
+
+    order = WeightedOrder()
+    order.durations = {item.nodeid: 1.0 for item in items}
+    order.durations["a::test_4"] = order.durations["c::test_2"] = 0.1
+    order.failures = {item.nodeid: [50, 0] for item in items}
+    order.failures["c::test_3"] = order.failures["c::test_2"] = [50, 25]
+
+    orders = set()
+    firsts = collections.Counter()
+    for seed in range(100):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=seed, order=order)
+        again = list(items)
+        _shuffle_items(again, bucket_key=module_key, seed=seed, order=order)
+        assert again == shuffled
+        orders.add(tuple(shuffled))
+        firsts[shuffled[0].nodeid] += 1
+
+    assert len(orders) == 100
+    assert firsts.most_common(1)[0] == ("c::test_2", pytest.approx(90, abs=8))
+
+
+def test_weighted_mode_uses_failures_recorded_in_previous_runs(testdir, get_test_calls):
+    testdir.makepyfile(
+        test_a="".join("def test_a{0}(): pass\n".format(i) for i in range(10)),
+        test_b="def test_fails(): assert False\n" + "".join("def test_b{0}(): pass\n".format(i) for i in range(9)),
+    )
+    for _ in range(3):
+        testdir.runpytest("--random-order").assert_outcomes(passed=19, failed=1)
+
+    failures = json.loads(testdir.tmpdir.join(".pytest_cache/v/random_order/failures").read())
+    assert failures["test_b.py::test_fails"] == [3, 3]
+    assert failures["test_b.py::test_b0"] == [3, 0]
+
+    firsts = []
+    for seed in range(10):
+        result = testdir.runpytest("--random-order-mode=weighted", "--random-order-seed={0}".format(seed))
+        result.assert_outcomes(passed=19, failed=1)
+        firsts.append(get_test_calls(result)[0].name)
+    assert firsts.count("test_fails") >= 5
+
+
+def get_adjacent_pairs(sequence):
+    return set(zip(sequence, sequence[1:]))
+
+
+@pytest.mark.parametrize("n", range(1, 10))
+def test_covering_orders_cover_all_ordered_pairs_in_one_period(n):
+    period = get_covering_period(n)
+    assert period <= n + 1
+    pairs = set()
+    for run_index in range(period):
+        order = get_covering_order(n, run_index)
+        assert sorted(order) == list(range(n))
+        pairs |= get_adjacent_pairs(order)
+    assert pairs == set((a, b) for a in range(n) for b in range(n) if a != b)
+    assert get_covering_order(n, period + 3) == get_covering_order(n, 3)
+
+
+def test_covering_order_covers_pairs_of_buckets_and_of_tests_within_buckets():
+    sizes = {"a": 5, "b": 2, "c": 4, "d": 1, "e": 3}
+    items = [Item("{0}::test_{1}".format(module, i), module) for module, size in sizes.items() for i in range(size)]
+
+    bucket_pairs = set()
+    item_pairs = set()
+    orders = set()
+    for run_index in range(get_covering_period(max(len(sizes), max(sizes.values())))):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=1, order=CoveringOrder(run_index=run_index))
+        again = list(items)
+        _shuffle_items(again, bucket_key=module_key, seed=1, order=CoveringOrder(run_index=run_index))
+        assert again == shuffled
+        orders.add(tuple(shuffled))
+
+        modules = [m for i, m in enumerate(item.module for item in shuffled) if i == 0 or m != shuffled[i - 1].module]
+        assert sorted(modules) == sorted(sizes)
+        bucket_pairs |= get_adjacent_pairs(modules)
+        item_pairs |= set((a, b) for a, b in get_adjacent_pairs(shuffled) if a.module == b.module)
+
+    assert len(bucket_pairs) == len(sizes) * (len(sizes) - 1)
+    assert len(item_pairs) == sum(size * (size - 1) for size in sizes.values())
+    assert len(orders) == get_covering_period(5)
+
+
+def test_covering_mode_advances_run_index_and_saves_plan_per_run(testdir, twenty_tests, get_test_calls):
+    testdir.makepyfile(test_a=twenty_tests)
+
+    calls = []
+    for run_index in range(2):
+        result = testdir.runpytest("--random-order-mode=covering", "--random-order-seed=7")
+        result.assert_outcomes(passed=20)
+        result.stdout.fnmatch_lines(["Using --random-order-run-index={0}".format(run_index)])
+        calls.append(get_test_calls(result))
+    assert calls[0] != calls[1]
+
+    result = testdir.runpytest("--random-order-replay-run=7-0")
+    assert get_test_calls(result) == calls[0]
+
+    result = testdir.runpytest("--random-order-mode=covering", "--random-order-seed=7", "--random-order-run-index=1")
+    assert get_test_calls(result) == calls[1]
+
+
+def test_guided_order_runs_suspects_after_new_predecessors():
+    items = [Item("{0}::test_{1}".format(module, i), module) for module in ("a", "b", "c", "d") for i in range(5)]
+    tried = {"b::test_0", "b::test_1"} | {"c::test_{0}".format(i) for i in range(5)}
+
+    order = GuidedOrder()
+    order.suspects = {"b::test_2", "b::test_3"}
+    order.predecessors = {"b::test_2": tried | {"a::test_0", "b::test_3"}, "b::test_3": tried | {"b::test_2"}}
+
+    orders = set()
+    for seed in range(20):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=seed, order=order)
+
+        # Buckets with tests which a suspect has not run after go first.
+        modules = [item.module for item in shuffled]
+        assert set(modules[:10]) == {"a", "d"}
+        assert set(modules[10:15]) in ({"b"}, {"c"})
+        b = [item.nodeid for item in shuffled if item.module == "b"]
+        assert b[0] == "b::test_4"
+        orders.add(tuple(modules))
+        orders.add(tuple(b))
+    assert len(orders) > 4
+
+
+def test_guided_mode_uses_history_of_previous_runs(testdir, get_test_calls):
+    testdir.makepyfile(
+        test_a=textwrap.dedent("""
+        state = []
+
+        def test_pollute():
+            state.append(1)
+
+        def test_victim():
+            assert not state
+        """)
+        + "".join("def test_a{0}(): pass\n".format(i) for i in range(15)),
+        test_b="".join("def test_b{0}(): pass\n".format(i) for i in range(5)),
+    )
+    # Run until the victim has both passed and failed.
+    for seed in range(20):
+        testdir.runpytest("--random-order-seed={0}".format(seed))
+        runs, failed = json.loads(testdir.tmpdir.join(".pytest_cache/v/random_order/failures").read())[
+            "test_a.py::test_victim"
+        ]
+        if 0 < failed < runs:
+            break
+
+    connection = history.connect(str(testdir.tmpdir.join(".pytest_cache/d/random_order/history.sqlite3")))
+    new_predecessors = []
+    for seed in range(3):
+        tried = history.get_predecessors(connection, ["test_a.py::test_victim"], 50)["test_a.py::test_victim"]
+        result = testdir.runpytest("--random-order-mode=guided", "--random-order-seed={0}".format(seed))
+        result.stdout.fnmatch_lines(["Using --random-order-mode=guided"])
+        nodeids = ["{0}.py::{1}".format(c.module, c.name) for c in get_test_calls(result)]
+        victim = nodeids.index("test_a.py::test_victim")
+        new = set(nodeids) - tried - {"test_a.py::test_victim"}
+        assert new <= set(nodeids[:victim])
+        new_predecessors.append(len(new))
+    # The first run tries all new predecessors, so the next ones have none left.
+    assert new_predecessors[0] > 0
+    assert new_predecessors[1:] == [0, 0]
+
+
+@pytest.mark.parametrize("n", range(1, 12))
+def test_derangement_gives_every_number_a_new_predecessor(n):
+    for seed in range(10):
+        order = get_derangement(n, random.Random(seed))
+        assert sorted(order) == list(range(n))
+        assert not get_adjacent_pairs(order) & get_adjacent_pairs(range(n))
+
+
+def test_derange_order_gives_every_test_and_bucket_a_new_predecessor():
+    sizes = {"a": 5, "b": 2, "c": 4, "d": 1, "e": 3}
+    items = [Item("{0}::test_{1}".format(module, i), module) for module, size in sizes.items() for i in range(size)]
+    previous = [item.nodeid for item in items if item.nodeid != "c::test_3"]
+    items.extend([Item("c::test_new", "c"), Item("f::test_new", "f")])
+
+    orders = set()
+    for seed in range(20):
+        shuffled = list(items)
+        _shuffle_items(shuffled, bucket_key=module_key, seed=seed, order=DerangeOrder(previous=previous))
+        nodeids = [item.nodeid for item in shuffled]
+        assert not get_adjacent_pairs(nodeids) & get_adjacent_pairs(previous)
+        modules = [m for i, m in enumerate(item.module for item in shuffled) if i == 0 or m != shuffled[i - 1].module]
+        assert sorted(modules) == list("abcdef")
+        assert not get_adjacent_pairs(modules) & get_adjacent_pairs("abcde")
+        orders.add(tuple(nodeids))
+    assert len(orders) > 10
+
+
+def test_derange_mode_gives_every_test_a_new_predecessor_in_every_run(testdir, get_test_calls):
+    testdir.makepyfile(
+        **{"test_{0}".format(m): "".join("def test_{0}{1}(): pass\n".format(m, i) for i in range(8)) for m in "abc"}
+    )
+    previous = get_test_calls(testdir.runpytest("--random-order"))
+    for _ in range(3):
+        result = testdir.runpytest("--random-order-mode=derange")
+        result.assert_outcomes(passed=24)
+        calls = get_test_calls(result)
+        assert not get_adjacent_pairs(calls) & get_adjacent_pairs(previous)
+        previous = calls
@@ -54,4 +54,8 @@ def test_seemingly_ok_shuffle_that_loses_items_fails_test_run(monkeypatch, simpl
     result.assert_outcomes(passed=0, failed=0, skipped=0)
     result.stdout.fnmatch_lines("""
         *INTERNALERROR> RuntimeError: pytest-random-order plugin has failed miserably*
+        *INTERNALERROR> Lost tests:*
+        *INTERNALERROR>   test_seemingly_ok_shuffle_that_loses_items_fails_test_run.py::test_a2*
+        *INTERNALERROR> Duplicated tests:*
+        *INTERNALERROR>   test_seemingly_ok_shuffle_that_loses_items_fails_test_run.py::test_a1*
     """)
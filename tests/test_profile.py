@@ -0,0 +1,78 @@
+import json
+
+from random_order import profile as profile_module
+from random_order.profile import Profile
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_profile_excludes_nested_phases_from_enclosing_phase(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profile_module, "time", clock)
+    profile = Profile()
+    sleep = profile.wrap("inner", clock.sleep)
+    with profile.phase("outer"):
+        clock.sleep(1.0)
+        sleep(2.0)
+        with profile.phase("nested"):
+            clock.sleep(4.0)
+    profile.count("things", 3)
+
+    assert profile.timings == {"inner": 2.0, "outer": 1.0, "nested": 4.0}
+    assert list(profile.timings) == ["inner", "outer", "nested"]
+    assert profile.counters == {"inner calls": 1, "things": 3}
+
+
+def test_profile_is_reported_and_written_to_json(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests, test_b=twenty_tests)
+
+    result = testdir.runpytest("--random-order-seed=1", "--random-order-profile-json=profile.json")
+    result.assert_outcomes(passed=40)
+    result.stdout.fnmatch_lines(
+        ["random-order profile: * ms (overrides * ms, shuffle * ms, keys * ms, disable * ms, *); items 40, *"]
+    )
+
+    with open(str(testdir.tmpdir.join("profile.json"))) as f:
+        profile = json.load(f)
+    assert profile["seed"] == "1"
+    assert profile["bucket_type"] == "module"
+    assert set(profile["timings"]) == {"overrides", "shuffle", "keys", "disable", "save plan", "integrity"}
+    assert profile["counters"]["items"] == 40
+    assert profile["counters"]["keys calls"] == 40
+    assert profile["counters"]["disable parents"] == 2
+
+
+def test_profile_is_off_by_default(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests)
+    result = testdir.runpytest("--random-order")
+    result.assert_outcomes(passed=20)
+    result.stdout.no_fnmatch_line("random-order profile:*")
+
+
+def test_profile_does_not_take_the_next_argument_as_path(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests, test_b=twenty_tests)
+    code = testdir.tmpdir.join("test_a.py").read()
+
+    result = testdir.runpytest("--random-order", "--random-order-profile", "test_a.py")
+    result.assert_outcomes(passed=20)
+    result.stdout.fnmatch_lines(["random-order profile: * ms *"])
+    assert testdir.tmpdir.join("test_a.py").read() == code
+
+
+def test_profile_does_not_overwrite_files_other_than_json(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests)
+    code = testdir.tmpdir.join("test_a.py").read()
+
+    result = testdir.runpytest("--random-order", "--random-order-profile-json=test_a.py")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*refusing to overwrite test_a.py, which is not a .json file*"])
+    assert testdir.tmpdir.join("test_a.py").read() == code
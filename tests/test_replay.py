@@ -0,0 +1,70 @@
+import pytest
+
+
+@pytest.fixture
+def testdir_with_tests(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests)
+    testdir.makepyfile(test_b=twenty_tests.replace("test_a", "test_b"))
+    return testdir
+
+
+def test_replay_runs_tests_in_saved_order_even_if_collection_changed(testdir_with_tests, get_test_calls):
+    result = testdir_with_tests.runpytest("--random-order-bucket=global", "--random-order-seed=5")
+    result.assert_outcomes(passed=40)
+    calls = get_test_calls(result)
+
+    testdir_with_tests.makepyfile(test_c="def test_c1(): pass\ndef test_c2(): pass\n")
+
+    result = testdir_with_tests.runpytest("--random-order-replay-run=5")
+    result.assert_outcomes(passed=42)
+    result.stdout.fnmatch_lines(["Using --random-order-replay-run=5"])
+    replayed_calls = get_test_calls(result)
+    assert replayed_calls[:40] == calls
+    assert [c.name for c in replayed_calls[40:]] == ["test_c1", "test_c2"]
+
+
+def test_replay_without_run_id_replays_last_run(testdir_with_tests, get_test_calls):
+    testdir_with_tests.runpytest("--random-order-seed=1").assert_outcomes(passed=40)
+    result = testdir_with_tests.runpytest("--random-order-seed=2")
+    result.assert_outcomes(passed=40)
+    calls = get_test_calls(result)
+
+    result = testdir_with_tests.runpytest("--random-order-replay")
+    result.assert_outcomes(passed=40)
+    assert get_test_calls(result) == calls
+
+    result = testdir_with_tests.runpytest("--random-order-replay-run=1")
+    result.assert_outcomes(passed=40)
+    assert get_test_calls(result) != calls
+
+
+@pytest.mark.parametrize(
+    "option", ["--random-order-sweep=2", "--random-order-bisect=test_a.py::test_a05"], ids=["sweep", "bisect"]
+)
+def test_replay_without_run_id_ignores_orders_that_did_not_run(testdir_with_tests, get_test_calls, option):
+    result = testdir_with_tests.runpytest("--random-order-seed=1")
+    result.assert_outcomes(passed=40)
+    calls = get_test_calls(result)
+
+    testdir_with_tests.runpytest("--random-order-seed=2", option, "--random-order-workers=2")
+
+    result = testdir_with_tests.runpytest("--random-order-replay")
+    result.assert_outcomes(passed=40)
+    assert get_test_calls(result) == calls
+
+
+def test_replay_does_not_take_the_next_argument_as_run_id(testdir_with_tests, get_test_calls):
+    result = testdir_with_tests.runpytest("--random-order-seed=1", "test_a.py")
+    result.assert_outcomes(passed=20)
+    calls = get_test_calls(result)
+
+    result = testdir_with_tests.runpytest("--random-order-replay", "test_a.py")
+    result.assert_outcomes(passed=20)
+    result.stdout.fnmatch_lines(["Using --random-order-replay"])
+    assert get_test_calls(result) == calls
+
+
+def test_replay_of_unknown_run_is_an_error(testdir_with_tests):
+    result = testdir_with_tests.runpytest("--random-order-replay-run=123")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*no saved test order found for --random-order-replay-run=123*"])
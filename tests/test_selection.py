@@ -0,0 +1,181 @@
+import argparse
+import collections
+import json
+import random
+
+import pytest
+
+from random_order.selection import (
+    apportion,
+    get_sample_count,
+    sample_items,
+    sample_size_option,
+    shard_items,
+    shard_option,
+)
+
+Item = collections.namedtuple("Item", field_names=("nodeid", "module"))
+
+
+def module_key(item, session):
+    return item.module
+
+
+@pytest.mark.parametrize(
+    "value, total, count",
+    [("10", 100, 10), ("10", 5, 5), ("0", 5, 0), ("10%", 100, 10), ("2.5%", 200, 5), ("1%", 10, 1), ("100%", 7, 7)],
+)
+def test_get_sample_count(value, total, count):
+    assert get_sample_count(value, total) == count
+
+
+@pytest.mark.parametrize("value", ["ten", "10%%", "-1", "-5%", ""])
+def test_invalid_sample_size(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        sample_size_option(value)
+
+
+def test_apportion_by_largest_remainder():
+    assert apportion(10, [50, 30, 20], random.Random(1)) == [5, 3, 2]
+    assert apportion(4, [5, 3, 2], random.Random(1)) == [2, 1, 1]
+    assert apportion(0, [5, 3], random.Random(1)) == [0, 0]
+    assert apportion(3, [0, 0], random.Random(1)) == [0, 0]
+
+    shares = set(tuple(apportion(2, [4, 4, 4, 4], random.Random(seed))) for seed in range(20))
+    assert all(sum(s) == 2 and max(s) == 1 for s in shares)
+    assert len(shares) > 1
+
+
+def test_sample_is_stratified_and_reproducible():
+    sizes = {"a": 40, "b": 30, "c": 20, "d": 10}
+    items = [Item("{0}::test_{1}".format(m, i), m) for m, size in sizes.items() for i in range(size)]
+
+    samples = set()
+    for seed in range(5):
+        selected, deselected = sample_items(items, "20%", bucket_key=module_key, seed=seed)
+        assert sample_items(items, "20%", bucket_key=module_key, seed=seed) == (selected, deselected)
+        assert len(selected) == 20
+        assert sorted(selected + deselected) == sorted(items)
+        assert [item for item in items if item in selected] == selected
+        assert collections.Counter(item.module for item in selected) == {"a": 8, "b": 6, "c": 4, "d": 2}
+        samples.add(tuple(selected))
+    assert len(samples) == 5
+
+
+def test_sample_option_deselects_tests(testdir, twenty_tests, get_test_calls):
+    testdir.makepyfile(test_a=twenty_tests, test_b=twenty_tests.replace("test_a", "test_b"))
+
+    result = testdir.runpytest("--random-order-sample=25%", "--random-order-seed=3")
+    result.assert_outcomes(passed=10)
+    result.stdout.fnmatch_lines(["Using --random-order-sample=25%", "*10 passed, 30 deselected*"])
+    calls = get_test_calls(result)
+    assert collections.Counter(c.module for c in calls) == {"test_a": 5, "test_b": 5}
+
+    result = testdir.runpytest("--random-order-sample=25%", "--random-order-seed=3")
+    assert get_test_calls(result) == calls
+
+    result = testdir.runpytest("--random-order-sample=lots")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*invalid sample size: 'lots'*"])
+
+
+@pytest.mark.parametrize("value", ["1", "0/3", "4/3", "a/b", "1/2/3", "-1/2"])
+def test_invalid_shard(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        shard_option(value)
+
+
+def test_shards_split_whole_buckets_by_duration():
+    durations = {"a": 6.0, "b": 5.0, "c": 4.0, "d": 3.0, "e": 2.0, "f": 1.0}
+    items = [Item("{0}::test_{1}".format(m, i), m) for m in durations for i in range(4)]
+
+    def get_duration(item):
+        return durations[item.module] / 4
+
+    shards = []
+    for shard in ("1/3", "2/3", "3/3"):
+        selected, deselected = shard_items(items, shard, get_duration, bucket_key=module_key, seed=1)
+        assert shard_items(items, shard, get_duration, bucket_key=module_key, seed=1) == (selected, deselected)
+        assert sorted(selected + deselected) == sorted(items)
+        assert [item for item in items if item in selected] == selected
+        shards.append(selected)
+
+    assert sorted(item for shard in shards for item in shard) == sorted(items)
+    modules = [set(item.module for item in shard) for shard in shards]
+    assert sorted(sum(durations[m] for m in shard) for shard in modules) == [7.0, 7.0, 7.0]
+
+
+def test_shards_without_durations_split_tests_by_number():
+    items = [Item("test_{0}".format(i), None) for i in range(10)]
+    sizes = [len(shard_items(items, "{0}/3".format(i), lambda item: 0.0, seed=1)[0]) for i in (1, 2, 3)]
+    assert sorted(sizes) == [0, 0, 10]
+
+    sizes = [
+        len(shard_items(items, "{0}/3".format(i), lambda item: 0.0, bucket_key=lambda item, s: item, seed=1)[0])
+        for i in (1, 2, 3)
+    ]
+    assert sorted(sizes) == [3, 3, 4]
+
+
+@pytest.fixture
+def sharded_tests(testdir):
+    sleeps = {"a": 0.01, "b": 0.005, "c": 0, "d": 0, "e": 0, "f": 0}
+    for m, sleep in sleeps.items():
+        code = "".join("def test_{0}{1}(): time.sleep({2})\n".format(m, i, sleep) for i in range(5))
+        testdir.makepyfile(**{"test_{0}".format(m): "import time\n" + code})
+    return testdir
+
+
+def run_shards(testdir, get_test_calls, *args):
+    modules = []
+    for shard in ("1/2", "2/2"):
+        # Each machine has its own cache.
+        result = testdir.runpytest(
+            "--random-order-shard={0}".format(shard),
+            "--random-order-seed=4",
+            "-o",
+            "cache_dir=.cache-{0}".format(shard[0]),
+            *args,
+        )
+        result.stdout.fnmatch_lines(["Using --random-order-shard={0}".format(shard)])
+        modules.append(set(c.module for c in get_test_calls(result)))
+    assert sorted(modules[0] | modules[1]) == ["test_a", "test_b", "test_c", "test_d", "test_e", "test_f"]
+    assert not modules[0] & modules[1]
+    return modules
+
+
+def test_shard_option_runs_part_of_tests(sharded_tests, get_test_calls):
+    # Durations recorded in each machine's cache, of the shards it ran, do not change the split.
+    splits = [run_shards(sharded_tests, get_test_calls) for _ in range(3)]
+    assert all(sorted(map(len, modules)) == [3, 3] for modules in splits)
+    assert splits[1] == splits[0] and splits[2] == splits[0]
+
+
+def test_shard_option_splits_by_shared_durations_file(sharded_tests, get_test_calls):
+    sharded_tests.makefile(
+        ".json",
+        durations=json.dumps(
+            dict(
+                {"test_a.py::test_a{0}".format(i): 3.0 for i in range(5)},
+                **{"test_{0}.py::test_{0}{1}".format(m, i): 0.6 for m in "bcdef" for i in range(5)},
+            )
+        ),
+    )
+    modules = run_shards(sharded_tests, get_test_calls, "--random-order-durations=durations.json")
+    assert sorted(modules, key=len) == [{"test_a"}, {"test_b", "test_c", "test_d", "test_e", "test_f"}]
+
+    result = sharded_tests.runpytest("--random-order-shard=1/2", "--random-order-durations=missing.json")
+    assert result.ret != 0
+    result.stderr.fnmatch_lines(["*--random-order-durations: cannot read missing.json:*"])
+
+
+def test_shard_option_ignores_failed_first_of_each_machine(sharded_tests, get_test_calls):
+    sharded_tests.makepyfile(
+        test_c="".join("def test_c{0}(): assert not __import__('os').path.exists('fail')\n".format(i) for i in range(5))
+    )
+    sharded_tests.tmpdir.join("fail").write("")
+    sharded_tests.runpytest("-o", "cache_dir=.cache-1").assert_outcomes(passed=25, failed=5)
+    sharded_tests.tmpdir.join("fail").remove()
+
+    # Only the machine of the first shard has failed tests in its cache.
+    assert run_shards(sharded_tests, get_test_calls, "--ff") == run_shards(sharded_tests, get_test_calls)
@@ -1,6 +1,17 @@
+import random
+from collections import OrderedDict
+
 import pytest
 
-from random_order.shuffler import _shuffle_items
+from random_order.order_types import ShuffleOrder
+from random_order.shuffler import (
+    ItemKey,
+    _bucket_rng,
+    _find_lost_items,
+    _shuffle_items,
+    apply_permutation,
+    bucket_items,
+)
 
 
 def identity_key(item, session):
@@ -172,6 +183,72 @@ def test_shuffle_respects_two_distinct_disabled_groups_in_one_bucket():
     assert False
 
 
+def test_bucket_items_groups_indices_by_key_and_disabled_sub_bucket():
+    items = [11, 12, 9995, 13, 9996, 9997, 14]
+
+    buckets = bucket_items(items, bucket_key=modulus_2_key, disable=disable_if_gt_1000)
+
+    assert buckets.keys == [ItemKey(1, False), ItemKey(0, False), ItemKey(1, 9), ItemKey(0, 9)]
+    assert len(buckets) == 4
+    assert list(buckets.indices) == [0, 3, 1, 6, 2, 5, 4]
+    assert buckets.offsets == [0, 2, 4, 6, 7]
+    assert [list(buckets.members(b)) for b in range(4)] == [[0, 3], [1, 6], [2, 5], [4]]
+
+
+def test_bucket_items_without_key_puts_all_items_in_one_bucket():
+    buckets = bucket_items([3, 1, 2])
+    assert buckets.keys == [ItemKey(None, None)]
+    assert list(buckets.members(0)) == [0, 1, 2]
+    assert buckets.offsets == [0, 3]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_permutation_keeps_buckets_together_and_disabled_sub_buckets_in_order(seed):
+    items = list(range(1, 30)) + [9991, 9992, 9993, 9994, 8881, 8882, 8883]
+    buckets = bucket_items(items, bucket_key=modulus_2_key, disable=disable_if_gt_1000)
+
+    permutation = buckets.get_permutation(items, seed, ShuffleOrder())
+    assert sorted(permutation) == list(range(len(items)))
+
+    shuffled = list(items)
+    apply_permutation(shuffled, permutation)
+    assert shuffled == [items[i] for i in permutation]
+    assert sorted(shuffled) == sorted(items)
+
+    key_changes = sum(
+        1
+        for prev, this in zip(shuffled, shuffled[1:])
+        if (modulus_2_key(prev, None), disable_if_gt_1000(prev, None))
+        != (modulus_2_key(this, None), disable_if_gt_1000(this, None))
+    )
+    assert key_changes == len(buckets) - 1
+    assert [i for i in shuffled if i > 9000] in ([9991, 9993, 9992, 9994], [9992, 9994, 9991, 9993])
+    assert [i for i in shuffled if 8000 < i < 9000] in ([8881, 8883, 8882], [8882, 8881, 8883])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_permutation_is_the_same_as_shuffling_bucket_lists(seed):
+    def bucket_key(item, session):
+        return item % 2 if item < 30 else item // 10
+
+    items = list(range(40)) + [9991, 9992, 9993]
+    expected_buckets = OrderedDict()
+    for item in items:
+        key = ItemKey(bucket_key(item, None), disable_if_gt_1000(item, None))
+        expected_buckets.setdefault(key, []).append(item)
+    ranks = []
+    for key, bucket in expected_buckets.items():
+        rng = _bucket_rng(seed, key)
+        ranks.append((rng.random(), key))
+        if not key.disabled:
+            rng.shuffle(bucket)
+    expected = [item for _, key in sorted(ranks) for item in expected_buckets[key]]
+
+    _shuffle_items(items, bucket_key=bucket_key, disable=disable_if_gt_1000, seed=seed)
+
+    assert items == expected
+
+
 def test_shuffle_respects_seed():
     sorted_items = list(range(30))
 
@@ -186,3 +263,68 @@ def test_shuffle_respects_seed():
         _shuffle_items(items2, seed=seed)
 
         assert items2 == items1
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        None,
+        identity_key,
+        modulus_2_key,
+    ],
+)
+def test_shuffle_does_not_touch_global_random_state(key):
+    random.seed(42)
+    expected = [random.random() for _ in range(5)]
+
+    random.seed(42)
+    _shuffle_items(list(range(30)), bucket_key=key, seed=123)
+    assert [random.random() for _ in range(5)] == expected
+
+
+def test_adding_a_bucket_does_not_reorder_other_buckets():
+    def tens_key(item, session):
+        return item // 10
+
+    items1 = list(range(50))
+    _shuffle_items(items1, bucket_key=tens_key, seed=7)
+
+    items2 = list(range(60))
+    _shuffle_items(items2, bucket_key=tens_key, seed=7)
+
+    assert [item for item in items2 if item < 50] == items1
+
+
+def test_bucket_order_does_not_depend_on_collection_order_of_buckets():
+    items1 = list(range(50))
+    _shuffle_items(items1, bucket_key=modulus_2_key, seed=7)
+
+    items2 = list(range(1, 50, 2)) + list(range(0, 50, 2))
+    _shuffle_items(items2, bucket_key=modulus_2_key, seed=7)
+
+    assert items1 == items2
+
+
+class Item:
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+
+def test_find_lost_items_accepts_permutation():
+    items = [Item("test_{0}".format(i)) for i in range(10)]
+    shuffled = list(items)
+    _shuffle_items(shuffled, seed=1)
+    assert _find_lost_items(items, shuffled) == ([], [])
+
+
+def test_find_lost_items_reports_lost_and_duplicated_tests():
+    items = [Item("test_{0}".format(i)) for i in range(5)]
+    broken = list(items)
+    broken[1] = broken[0]
+    del broken[3]
+    assert _find_lost_items(items, broken) == (["test_1", "test_3"], ["test_0"])
+
+
+def test_find_lost_items_accepts_items_replaced_with_same_node_ids():
+    items = [Item("test_{0}".format(i)) for i in range(5)]
+    assert _find_lost_items(items, [Item(item.nodeid) for item in items]) == ([], [])
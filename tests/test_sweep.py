@@ -0,0 +1,65 @@
+import re
+import textwrap
+
+from random_order.sweep import SeedResult, Sweep, derive_seeds
+
+
+def test_derive_seeds_is_deterministic_and_distinct():
+    seeds = derive_seeds("123", 50)
+    assert seeds == derive_seeds("123", 50)
+    assert len(set(seeds)) == 50
+    assert derive_seeds("124", 50) != seeds
+    assert derive_seeds("123", 10) == seeds[:10]
+
+
+def test_sweep_aggregates_failures_per_test():
+    def run_seed(seed):
+        returncode = {"1": 1, "2": 1, "3": 0, "4": 2}[seed]
+        return SeedResult(seed, returncode, ["test_b", "test_a"] if seed in ("1", "2") else [])
+
+    result = Sweep(None, ["1", "2", "3", "4"], workers=2, run_seed=run_seed).run()
+    assert [r.seed for r in result.failed_seeds] == ["1", "2", "4"]
+    assert result.get_failed_tests() == [("test_a", ["1", "2"]), ("test_b", ["1", "2"])]
+    assert result.format_lines() == [
+        "random-order sweep: 3 of 4 seeds failed:",
+        "  seed 1: 2 failed",
+        "  seed 2: 2 failed",
+        "  seed 4: pytest exited with code 2",
+        "random-order sweep: tests that failed:",
+        "  test_a: 2 of 4 seeds (1, 2)",
+        "  test_b: 2 of 4 seeds (1, 2)",
+    ]
+
+
+def test_sweep_reports_order_dependent_failures_and_saves_their_orders(testdir):
+    testdir.makepyfile(
+        test_a=textwrap.dedent("""
+        polluted = []
+
+        def test_polluter(): polluted.append(True)
+        def test_victim(): assert not polluted
+        def test_clean(): pass
+    """)
+    )
+
+    result = testdir.runpytest("--random-order-seed=1", "--random-order-sweep=8", "--random-order-workers=4")
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(
+        [
+            "random-order sweep: * of 8 seeds failed:",
+            "  seed *: 1 failed, replay with --random-order-replay-run=*",
+            "random-order sweep: tests that failed:",
+            "  test_a.py::test_victim: * of 8 seeds (*)",
+        ]
+    )
+
+    seed = re.search(r"replay with --random-order-replay-run=(\d+)", result.stdout.str()).group(1)
+    result = testdir.runpytest("--random-order-replay-run={0}".format(seed))
+    result.assert_outcomes(passed=2, failed=1)
+
+
+def test_sweep_of_passing_tests(testdir):
+    testdir.makepyfile(test_a="def test_a(): pass\ndef test_b(): pass\n")
+    result = testdir.runpytest("--random-order-sweep=3")
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(["random-order sweep: all 3 seeds passed"])
@@ -1,5 +1,107 @@
+import collections
+import re
+import textwrap
+
+import pytest
+
+from random_order.replay import write_plan
+from random_order.xdist_scheduling import get_nodeid_scope, get_work_units
+
+
 def test_xdist_not_broken(testdir, twenty_tests):
     testdir.makepyfile(twenty_tests)
 
     result = testdir.runpytest("--random-order", "-n", "5")
     result.assert_outcomes(passed=20)
+
+
+def test_xdist_workers_replay_plan_loaded_on_main(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests)
+    write_plan(
+        str(testdir.tmpdir.join("plan.txt.gz")),
+        ["test_a.py::test_a{0:02d}".format(i) for i in range(5)],
+        exclusive=True,
+    )
+    # Workers cannot read the plan file themselves.
+    testdir.makeconftest(
+        textwrap.dedent("""
+        import os
+
+        import pytest
+
+        @pytest.hookimpl(trylast=True)
+        def pytest_configure_node(node):
+            if os.path.exists("plan.txt.gz"):
+                os.remove("plan.txt.gz")
+        """)
+    )
+
+    result = testdir.runpytest("--random-order-replay-run=plan.txt.gz", "-n", "2")
+    result.assert_outcomes(passed=5)
+
+
+def test_xdist_workers_derange_the_same_previous_order(testdir, twenty_tests):
+    testdir.makepyfile(test_a=twenty_tests, test_b=twenty_tests.replace("test_a", "test_b"))
+    testdir.runpytest("--random-order").assert_outcomes(passed=40)
+
+    for _ in range(3):
+        result = testdir.runpytest("--random-order-mode=derange", "-n", "4")
+        result.assert_outcomes(passed=40)
+
+
+@pytest.mark.parametrize(
+    "bucket_type, scope",
+    [
+        ("module", "tests/test_a.py"),
+        ("class", "tests/test_a.py::TestA"),
+        ("parent", "tests/test_a.py::TestA"),
+        ("grandparent", "tests/test_a.py"),
+        ("package", "tests"),
+        ("package/module/class", ("tests", "tests/test_a.py", "tests/test_a.py::TestA")),
+        ("module/fixture", ("tests/test_a.py", "tests/test_a.py")),
+        ("global", "tests/test_a.py::TestA::test_x[a::b]"),
+    ],
+)
+def test_nodeid_scope(bucket_type, scope):
+    assert get_nodeid_scope("tests/test_a.py::TestA::test_x[a::b]", bucket_type) == scope
+    other_scope = get_nodeid_scope("tests/test_a.py::TestA::test_y", bucket_type, {})
+    assert (other_scope == scope) == (bucket_type != "global")
+
+
+def test_work_units_are_runs_of_buckets_split_if_too_large():
+    nodeids = ["a.py::t1", "a.py::t2", "b.py::t1", "a.py::t3"] + ["c.py::t{0}".format(i) for i in range(5)]
+    assert get_work_units(nodeids, "module", 3) == [
+        ["a.py::t1", "a.py::t2"],
+        ["b.py::t1"],
+        ["a.py::t3"],
+        ["c.py::t0", "c.py::t1", "c.py::t2"],
+        ["c.py::t3", "c.py::t4"],
+    ]
+
+
+def get_workers_of_modules(result):
+    workers = collections.defaultdict(set)
+    for line in result.outlines:
+        match = re.match(r"\[(gw\d+)\].* PASSED (\w+)\.py::", line)
+        if match:
+            workers[match.group(2)].add(match.group(1))
+    return workers
+
+
+def test_xdist_loadscope_sends_whole_buckets_to_workers(testdir, twenty_tests):
+    testdir.makepyfile(
+        **{"test_{0}".format(m): twenty_tests.replace("test_a", "test_{0}".format(m)) for m in ("a", "b", "c", "d")}
+    )
+
+    result = testdir.runpytest("--random-order", "-n", "2", "--dist", "loadscope", "-v")
+    result.assert_outcomes(passed=80)
+    result.stdout.fnmatch_lines(["scheduling tests via BucketScheduling"])
+    workers = get_workers_of_modules(result)
+    assert sorted(workers) == ["test_a", "test_b", "test_c", "test_d"]
+    assert all(len(w) == 1 for w in workers.values())
+
+    # A bucket larger than a worker's share is split between workers.
+    testdir.makepyfile(test_e="".join("def test_e{0}(): pass\n".format(i) for i in range(100)))
+    result = testdir.runpytest("--random-order", "-n", "2", "--dist", "loadscope", "-v")
+    result.assert_outcomes(passed=180)
+    assert get_workers_of_modules(result)["test_e"] == {"gw0", "gw1"}